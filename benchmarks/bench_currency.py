@@ -0,0 +1,97 @@
+"""Micro-benchmark: cached CurrencyFormatter vs. the original format_currency.
+
+Usage::
+
+    python benchmarks/bench_currency.py [--values 200000] [--repeat 5]
+
+Results are printed as JSON.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docfactory_core import RenderCore  # noqa: E402
+
+
+def legacy_format_currency(value: Any, currency: str = "EUR", decimals: int = 2) -> str:
+    """The implementation RenderCore shipped before the formatter registry."""
+    if value is None or value == "":
+        return ""
+    try:
+        amount = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return str(value)
+
+    quantized = amount.quantize(Decimal(10) ** -decimals)
+    formatted = f"{quantized:,.{decimals}f}"
+    formatted = formatted.replace(",", "X").replace(".", ",").replace("X", ".")
+    return f"{formatted} {currency}".strip()
+
+
+def best_of(func: Callable[[Any], str], values: List[Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for value in values:
+            func(value)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(count: int, repeat: int) -> Dict[str, Any]:
+    rng = random.Random(42)
+    values = [round(rng.uniform(-1_000_000, 1_000_000), 2) for _ in range(count)]
+    mismatches = sum(
+        1 for value in values[:1000]
+        if legacy_format_currency(value) != RenderCore._format_currency(value)
+    )
+
+    results: Dict[str, Any] = {}
+    for name, func in (
+        ("legacy", legacy_format_currency),
+        ("registry", RenderCore._format_currency),
+    ):
+        seconds = best_of(func, values, repeat)
+        results[name] = {
+            "seconds": round(seconds, 6),
+            "values_per_second": round(count / seconds),
+        }
+    results["registry"]["speedup_vs_legacy"] = round(
+        results["legacy"]["seconds"] / results["registry"]["seconds"], 2
+    )
+
+    template = "{% for v in values %}{{ v|format_currency }}\n{% endfor %}"
+    renderer = RenderCore()
+    renderer.render(template, {"values": values[:10]})
+    started = time.perf_counter()
+    renderer.render(template, {"values": values})
+    results["template_render_seconds"] = round(time.perf_counter() - started, 6)
+
+    return {
+        "benchmark": "format_currency",
+        "values": count,
+        "output_mismatches": mismatches,
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--values", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.values, args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
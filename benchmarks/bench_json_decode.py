@@ -0,0 +1,88 @@
+"""Compare the JSON decoders available to ``RenderCore.coerce_json``.
+
+Builds customer-ledger shaped payloads of increasing size and times every
+decoder in ``JSON_DECODERS`` on both ``str`` and ``bytes`` input.
+
+Usage::
+
+    python benchmarks/bench_json_decode.py [--sizes-mb 0.1 1 5 20 50] [--repeat 3]
+
+Install ``orjson`` to include the accelerated decoder in the comparison.
+Results are printed as JSON.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docfactory_core import JSON_DECODERS, RenderCore  # noqa: E402
+
+
+def build_ledger(target_bytes: int) -> str:
+    entry = {
+        "date": "2024-03-15",
+        "document": "INV-000000",
+        "description": "Consulting services - monthly retainer",
+        "debit": 1250.5,
+        "credit": 0.0,
+        "balance": -3420.75,
+        "tags": ["services", "recurring"],
+    }
+    entry_size = len(json.dumps(entry)) + 2
+    count = max(1, target_bytes // entry_size)
+    movements = [dict(entry, document=f"INV-{index:06d}") for index in range(count)]
+    return json.dumps({"customer_code": "C12345", "year": 2024, "movements": movements})
+
+
+def time_decoder(name: str, payload: Any, repeat: int) -> float:
+    RenderCore.select_json_decoder(name)
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        RenderCore.coerce_json(payload, field_name="data", required=True)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(sizes_mb: List[float], repeat: int) -> Dict[str, Any]:
+    previous = RenderCore.json_decoder
+    results: List[Dict[str, Any]] = []
+    try:
+        for size_mb in sizes_mb:
+            text = build_ledger(int(size_mb * 1024 * 1024))
+            raw = text.encode("utf-8")
+            row: Dict[str, Any] = {"payload_bytes": len(raw), "decoders": {}}
+            for name in JSON_DECODERS:
+                str_seconds = time_decoder(name, text, repeat)
+                bytes_seconds = time_decoder(name, raw, repeat)
+                row["decoders"][name] = {
+                    "str_seconds": round(str_seconds, 6),
+                    "bytes_seconds": round(bytes_seconds, 6),
+                    "mb_per_second": round(len(raw) / 1048576 / str_seconds, 2),
+                }
+            baseline = row["decoders"]["json"]["str_seconds"]
+            for stats in row["decoders"].values():
+                stats["speedup_vs_json"] = round(baseline / stats["str_seconds"], 2)
+            results.append(row)
+    finally:
+        RenderCore.select_json_decoder(previous)
+    return {"benchmark": "json_decode", "decoders": sorted(JSON_DECODERS), "results": results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[0.1, 1, 5, 20, 50])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(run(args.sizes_mb, args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Benchmark: Knowledge Base operations against the local fake Dify API.
+
+Starts ``fake_dify_kb.FakeKnowledgeBase`` in-process and runs
+``save_text_document`` (create + metadata) followed by
+``replace_with_single_segment`` for every operation, optionally from
+several threads. Latency, error rate, 429s and indexing delay are
+forwarded to the fake server, so throughput and retry behaviour can be
+compared offline and reproducibly.
+
+Usage::
+
+    python benchmarks/bench_kb_operations.py [--operations 50] [--concurrency 4]
+                                             [--latency-ms 10] [--error-rate 0.02]
+                                             [--throttle-rate 0.05] [--indexing-delay 0.5]
+                                             [--rate-limit 20] [--dataset-rate-limit 10]
+
+Results are printed as JSON.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from docfactory_core import (  # noqa: E402
+    KnowledgeBaseChunkCore,
+    KnowledgeBaseClient,
+    KnowledgeBaseDocumentCore,
+    KnowledgeBaseError,
+)
+from fake_dify_kb import FakeKnowledgeBase, FakeKnowledgeBaseConfig  # noqa: E402
+
+API_KEY = "bench-key"
+
+
+def run_operation(args: argparse.Namespace, base_url: str, index: int, text: str) -> Dict[str, Any]:
+    client = KnowledgeBaseClient(
+        base_url,
+        API_KEY,
+        rate_limit=args.rate_limit,
+        dataset_rate_limit=args.dataset_rate_limit,
+    )
+    started = time.perf_counter()
+    try:
+        saved = KnowledgeBaseDocumentCore(client).save_text_document(
+            rendered_text=text,
+            parameters={
+                "dataset_id": "bench-dataset",
+                "document_name": f"bench-document-{index}",
+                "metadata_json": {"customer_code": f"C{index:05d}"},
+            },
+        )
+        chunk_core = KnowledgeBaseChunkCore(client)
+        chunk_core.replace_with_single_segment(
+            dataset_id="bench-dataset",
+            document_id=saved["document_id"],
+            content=text,
+            poll_interval_seconds=args.poll_interval,
+        )
+        error = None
+    except KnowledgeBaseError as exc:
+        error = f"{exc.status_code}: {str(exc)[:120]}"
+        chunk_core = None
+    return {
+        "seconds": time.perf_counter() - started,
+        "http_calls": len(client.calls),
+        "sleep_seconds": chunk_core.sleep_seconds if chunk_core is not None else 0.0,
+        "retries": client.retry_count,
+        "rate_limit_wait_seconds": client.rate_limit_wait_seconds,
+        "error": error,
+    }
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    config = FakeKnowledgeBaseConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        requests_per_second=args.requests_per_second,
+        indexing_delay_seconds=args.indexing_delay,
+        api_key=API_KEY,
+        seed=args.seed,
+    )
+    text = "DocFactory benchmark document. " * max(1, args.text_bytes // 31)
+    with FakeKnowledgeBase(config) as server:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+            results = list(
+                executor.map(
+                    lambda index: run_operation(args, server.base_url, index, text),
+                    range(args.operations),
+                )
+            )
+        elapsed = time.perf_counter() - started
+        server_stats = server.stats()
+
+    succeeded = [item["seconds"] for item in results if item["error"] is None]
+    errors = [item["error"] for item in results if item["error"] is not None]
+    return {
+        "benchmark": "kb_operations",
+        "operations": args.operations,
+        "concurrency": args.concurrency,
+        "fault_config": {
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "error_rate": args.error_rate,
+            "throttle_rate": args.throttle_rate,
+            "requests_per_second": args.requests_per_second,
+            "indexing_delay_seconds": args.indexing_delay,
+        },
+        "client_rate_limit": args.rate_limit,
+        "client_dataset_rate_limit": args.dataset_rate_limit,
+        "elapsed_seconds": round(elapsed, 4),
+        "operations_per_second": round(args.operations / elapsed, 3) if elapsed else None,
+        "succeeded": len(succeeded),
+        "failed": len(errors),
+        "latency_seconds": {
+            "p50": round(percentile(succeeded, 0.5), 4),
+            "p95": round(percentile(succeeded, 0.95), 4),
+            "max": round(max(succeeded), 4) if succeeded else 0.0,
+        },
+        "client_http_calls": sum(item["http_calls"] for item in results),
+        "indexing_sleep_seconds": round(sum(item["sleep_seconds"] for item in results), 4),
+        "client_retries": sum(item["retries"] for item in results),
+        "rate_limit_wait_seconds": round(sum(item["rate_limit_wait_seconds"] for item in results), 4),
+        "sample_errors": errors[:5],
+        "server": server_stats,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--operations", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--text-bytes", type=int, default=4096)
+    parser.add_argument("--latency-ms", type=float, default=10.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--requests-per-second", type=float)
+    parser.add_argument("--indexing-delay", type=float, default=0.2)
+    parser.add_argument("--poll-interval", type=float, default=0.1)
+    parser.add_argument("--rate-limit", type=float, help="client-side requests per second per base URL")
+    parser.add_argument("--dataset-rate-limit", type=float, help="client-side requests per second per dataset")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""Benchmark: RenderCore parse, compile, cold render and cached render.
+
+Builds synthetic JSON payloads (1 KB to 100 MB by default) and renders them
+with three templates of increasing cost:
+
+* ``flat`` – top-level fields only,
+* ``nested_loops`` – customers -> invoices -> lines,
+* ``filters`` – the same loops with heavy use of the DocFactory filters.
+
+Every (size, template) case runs in a fresh interpreter so its peak RSS is
+not inflated by earlier, larger cases.
+
+Usage::
+
+    python benchmarks/bench_render.py [--sizes 1KB,1MB,100MB] [--templates flat,filters]
+                                      [--repeat 3] [--output results.json]
+
+Results are printed as JSON (and written to ``--output`` when given).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jinja2  # noqa: E402
+
+from docfactory_core import RenderCore  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None  # type: ignore[assignment]
+
+DEFAULT_SIZES = "1KB,10KB,100KB,1MB,10MB,100MB"
+
+TEMPLATES: Dict[str, str] = {
+    "flat": """\
+{{ company.name }} ({{ company.vat_id }})
+{{ company.address.street }}, {{ company.address.city }} {{ company.address.zip }}
+Period: {{ period.start }} - {{ period.end }}
+Customers: {{ customers|length }}
+""",
+    "nested_loops": """\
+{{ company.name }}
+{% for customer in customers %}
+## {{ customer.code }} {{ customer.name }} <{{ customer.email }}>
+{% for invoice in customer.invoices %}
+- {{ invoice.number }} {{ invoice.date }} {{ invoice.total }}
+{% for line in invoice.lines %}
+  * {{ line.sku }} x{{ line.qty }} @ {{ line.price }}
+{% endfor %}
+{% endfor %}
+{% endfor %}
+""",
+    "filters": """\
+{{ company.name|upper }} - {{ period.start|format_date("%d %b %Y") }}
+{% for customer in customers %}
+## {{ customer.code }} {{ customer.name|title }} since {{ customer.created_at|format_date }}
+Balance: {{ customer.balance|format_currency("EUR", style="eu") }}
+{% set totals = customer.invoices|group_sum("status", "total") %}
+{% for status, amount in totals|dictsort %}{{ status }}={{ amount|format_currency("USD", style="us") }} {% endfor %}
+
+{% for invoice in customer.invoices %}
+- {{ invoice.number }} {{ invoice.date|format_date("%Y/%m/%d") }} {{ invoice.total|format_currency }}
+  lines: {{ invoice.lines|format_currency_all(attribute="price")|join(", ") }}
+  qty: {{ invoice.lines|sum_by("qty") }} skus: {{ invoice.lines|map(attribute="sku")|sort|join("/") }}
+{% endfor %}
+{% endfor %}
+""",
+}
+
+_UNITS = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3}
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    for unit in ("GB", "MB", "KB", "B"):
+        if text.endswith(unit):
+            return int(float(text[: -len(unit)]) * _UNITS[unit])
+    return int(text)
+
+
+def build_customer(index: int) -> Dict[str, Any]:
+    invoices = []
+    for number in range(3):
+        lines = [
+            {"sku": f"SKU-{(index * 31 + line) % 9973:05d}", "qty": line + 1, "price": 9.5 + line * 3.25}
+            for line in range(4)
+        ]
+        invoices.append(
+            {
+                "number": f"INV-{index:07d}-{number}",
+                "date": f"2024-{(number % 12) + 1:02d}-{(index % 28) + 1:02d}",
+                "status": ("paid", "open", "overdue")[(index + number) % 3],
+                "total": round(sum(line["qty"] * line["price"] for line in lines), 2),
+                "lines": lines,
+            }
+        )
+    return {
+        "code": f"C{index:07d}",
+        "name": f"customer number {index}",
+        "email": f"customer{index}@example.com",
+        "created_at": f"{(index % 28) + 1:02d}/{(index % 12) + 1:02d}/2019",
+        "balance": (index * 37) % 10000 + 0.5,
+        "invoices": invoices,
+    }
+
+
+def build_payload(target_bytes: int) -> str:
+    """Return a JSON document of roughly ``target_bytes`` bytes."""
+    header = {
+        "company": {
+            "name": "DocFactory Benchmarks S.r.l.",
+            "vat_id": "IT01234567890",
+            "address": {"street": "Via Roma 1", "city": "Milano", "zip": "20100"},
+        },
+        "period": {"start": "2024-01-01", "end": "2024-12-31"},
+        "customers": [],
+    }
+    base_size = len(json.dumps(header))
+    customer_size = len(json.dumps(build_customer(0))) + 2
+    count = max(1, (target_bytes - base_size) // customer_size)
+    header["customers"] = [build_customer(index) for index in range(count)]
+    return json.dumps(header)
+
+
+def peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return int(peak if sys.platform == "darwin" else peak * 1024)
+
+
+def run_case(size: int, template_name: str, repeat: int) -> Dict[str, Any]:
+    template = TEMPLATES[template_name]
+    rss_before = peak_rss_bytes()
+    payload = build_payload(size)
+    payload_bytes = len(payload.encode("utf-8"))
+
+    started = time.perf_counter()
+    data = RenderCore.coerce_json(payload, field_name="data", required=True)
+    decode_seconds = time.perf_counter() - started
+    del payload
+
+    renderer = RenderCore()
+    env = renderer.get_environment(renderer._normalize_options({}))
+    started = time.perf_counter()
+    ast = env.parse(template)
+    parse_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    env.compile(ast)
+    compile_seconds = time.perf_counter() - started
+
+    # Cold: empty compiled-template cache, so this includes parse + compile.
+    RenderCore.template_cache.clear()
+    started = time.perf_counter()
+    output = renderer.render(template, data)
+    cold_seconds = time.perf_counter() - started
+
+    cached_runs: List[float] = []
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        renderer.render(template, data)
+        cached_runs.append(time.perf_counter() - started)
+    cached_seconds = min(cached_runs)
+
+    return {
+        "template": template_name,
+        "payload_bytes": payload_bytes,
+        "customers": len(data["customers"]),
+        "output_chars": len(output),
+        "decode_seconds": round(decode_seconds, 6),
+        "parse_seconds": round(parse_seconds, 6),
+        "compile_seconds": round(compile_seconds, 6),
+        "cold_render_seconds": round(cold_seconds, 6),
+        "cached_render_seconds": round(cached_seconds, 6),
+        "cached_render_runs": [round(value, 6) for value in cached_runs],
+        "throughput_mb_per_second": round(payload_bytes / 1024**2 / cached_seconds, 3)
+        if cached_seconds
+        else None,
+        "output_chars_per_second": round(len(output) / cached_seconds) if cached_seconds else None,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "baseline_rss_bytes": rss_before,
+    }
+
+
+def run_isolated(size: int, template_name: str, repeat: int) -> Dict[str, Any]:
+    completed = subprocess.run(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--case",
+            f"{size}:{template_name}",
+            "--repeat",
+            str(repeat),
+        ],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if completed.returncode != 0:
+        return {
+            "template": template_name,
+            "target_bytes": size,
+            "error": completed.stderr.strip().splitlines()[-1:] or ["failed"],
+        }
+    return json.loads(completed.stdout)
+
+
+def run(sizes: List[int], template_names: List[str], repeat: int) -> Dict[str, Any]:
+    results = []
+    for size in sizes:
+        for template_name in template_names:
+            case = run_isolated(size, template_name, repeat)
+            case["target_bytes"] = size
+            results.append(case)
+    return {
+        "benchmark": "render",
+        "python": platform.python_version(),
+        "jinja2": jinja2.__version__,
+        "platform": platform.platform(),
+        "json_decoder": getattr(RenderCore.json_decoder, "__module__", None),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated payload sizes")
+    parser.add_argument("--templates", default=",".join(TEMPLATES), help="comma-separated template names")
+    parser.add_argument("--repeat", type=int, default=3, help="cached renders per case (best is reported)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        size, template_name = args.case.split(":", 1)
+        print(json.dumps(run_case(int(size), template_name, args.repeat)))
+        return
+
+    template_names = [name.strip() for name in args.templates.split(",") if name.strip()]
+    unknown = sorted(set(template_names) - set(TEMPLATES))
+    if unknown:
+        parser.error(f"unknown templates: {', '.join(unknown)}")
+    sizes = [parse_size(size) for size in args.sizes.split(",") if size.strip()]
+    report = json.dumps(run(sizes, template_names, args.repeat), indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
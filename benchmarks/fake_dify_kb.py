@@ -0,0 +1,586 @@
+"""Fake Dify Knowledge Base API for offline load and retry testing.
+
+Implements the endpoints DocFactory calls, with in-memory datasets:
+
+* ``POST /datasets/{ds}/document/create-by-text``
+* ``POST /datasets/{ds}/documents/{doc}/update_by_text``
+* ``GET  /datasets/{ds}/documents`` (``keyword``, ``page``, ``limit``)
+* ``GET  /datasets/{ds}/documents/{doc}``
+* ``GET  /datasets/{ds}/documents/{batch}/indexing-status``
+* ``GET/POST /datasets/{ds}/metadata`` and ``POST /datasets/{ds}/documents/metadata``
+* ``GET/POST /datasets/{ds}/documents/{doc}/segments`` and
+  ``DELETE /datasets/{ds}/documents/{doc}/segments/{segment}``
+
+Faults are configurable and reproducible (seeded): fixed latency plus
+jitter, a random 5xx error rate, random or rate-based 429 responses with a
+``Retry-After`` header, and an indexing delay during which documents report
+``indexing`` and refuse new segments. ``GET /_stats`` returns request
+counters; ``POST /_reset`` clears data and counters.
+
+Usage::
+
+    python benchmarks/fake_dify_kb.py [--port 5001] [--latency-ms 20] [--error-rate 0.01]
+                                      [--throttle-rate 0.05] [--requests-per-second 50]
+                                      [--indexing-delay 2] [--api-key secret]
+
+    # then point the plugin (or KnowledgeBaseClient) at http://127.0.0.1:5001/v1
+
+In-process use::
+
+    with FakeKnowledgeBase(FakeKnowledgeBaseConfig(latency_ms=5)) as server:
+        client = KnowledgeBaseClient(server.base_url, "any-key")
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from uuid import uuid4
+
+API_PREFIX = "/v1"
+
+
+class FakeKnowledgeBaseConfig:
+    """Fault injection knobs; every probability is drawn from a seeded RNG."""
+
+    def __init__(
+        self,
+        *,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        requests_per_second: Optional[float] = None,
+        retry_after_seconds: float = 1.0,
+        indexing_delay_seconds: float = 0.0,
+        segment_size: int = 500,
+        api_key: Optional[str] = None,
+        seed: int = 1234,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.requests_per_second = requests_per_second
+        self.retry_after_seconds = retry_after_seconds
+        self.indexing_delay_seconds = indexing_delay_seconds
+        self.segment_size = max(1, segment_size)
+        self.api_key = api_key
+        self.seed = seed
+
+
+class FakeKnowledgeBaseState:
+    """In-memory datasets, documents, metadata fields and segments."""
+
+    def __init__(self, config: FakeKnowledgeBaseConfig) -> None:
+        self.config = config
+        self.lock = threading.Lock()
+        self.random = random.Random(config.seed)
+        self.documents: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.metadata_fields: Dict[str, List[Dict[str, Any]]] = {}
+        self.segments: Dict[str, List[Dict[str, Any]]] = {}
+        self.counters: Counter = Counter()
+        self.recent_requests: Deque[float] = deque()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.random = random.Random(self.config.seed)
+            self.documents.clear()
+            self.metadata_fields.clear()
+            self.segments.clear()
+            self.counters.clear()
+            self.recent_requests.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            by_status: Counter = Counter()
+            by_endpoint: Counter = Counter()
+            for (endpoint, status), count in self.counters.items():
+                by_status[str(status)] += count
+                by_endpoint[endpoint] += count
+            return {
+                "requests": sum(self.counters.values()),
+                "by_status": dict(by_status),
+                "by_endpoint": dict(by_endpoint),
+                "documents": sum(len(docs) for docs in self.documents.values()),
+            }
+
+    def inject_fault(self) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """Return a (status, body) fault for this request, or None."""
+        config = self.config
+        with self.lock:
+            now = time.monotonic()
+            if config.requests_per_second:
+                window = self.recent_requests
+                while window and now - window[0] >= 1.0:
+                    window.popleft()
+                if len(window) >= config.requests_per_second:
+                    return 429, {"code": "too_many_requests", "message": "Rate limit exceeded.", "status": 429}
+                window.append(now)
+            draw = self.random.random()
+        if draw < config.throttle_rate:
+            return 429, {"code": "too_many_requests", "message": "Rate limit exceeded.", "status": 429}
+        if draw < config.throttle_rate + config.error_rate:
+            return 500, {"code": "internal_server_error", "message": "Injected failure.", "status": 500}
+        return None
+
+    def latency_seconds(self) -> float:
+        config = self.config
+        with self.lock:
+            jitter = self.random.uniform(0, config.jitter_ms) if config.jitter_ms else 0.0
+        return max(0.0, config.latency_ms + jitter) / 1000
+
+    # --- documents -----------------------------------------------------
+
+    def save_document(self, dataset_id: str, document_id: Optional[str], name: str, text: str) -> Dict[str, Any]:
+        with self.lock:
+            documents = self.documents.setdefault(dataset_id, {})
+            document = documents.get(document_id) if document_id else None
+            if document is None:
+                document_id = str(uuid4())
+                document = {
+                    "id": document_id,
+                    "position": len(documents) + 1,
+                    "data_source_type": "upload_file",
+                    "created_from": "api",
+                    "created_at": int(time.time()),
+                    "doc_metadata": [],
+                }
+                documents[document_id] = document
+            document["name"] = name
+            document["word_count"] = len(text.split())
+            document["batch"] = uuid4().hex
+            document["indexing_started_at"] = time.monotonic()
+            self.segments[document["id"]] = [
+                self._segment(document["id"], index, text[start : start + self.config.segment_size])
+                for index, start in enumerate(range(0, max(len(text), 1), self.config.segment_size))
+            ]
+            return self.public_document(document)
+
+    def find_document(self, dataset_id: str, document_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            document = self.documents.get(dataset_id, {}).get(document_id)
+            return self.public_document(document) if document else None
+
+    def find_by_batch(self, dataset_id: str, batch: str) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [
+                self.public_document(document)
+                for document in self.documents.get(dataset_id, {}).values()
+                if document.get("batch") == batch or document["id"] == batch
+            ]
+
+    def list_documents(self, dataset_id: str, keyword: str, page: int, limit: int) -> Dict[str, Any]:
+        with self.lock:
+            documents = [
+                self.public_document(document)
+                for document in self.documents.get(dataset_id, {}).values()
+                if not keyword or keyword.lower() in document["name"].lower()
+            ]
+        start = (page - 1) * limit
+        return {
+            "data": documents[start : start + limit],
+            "has_more": start + limit < len(documents),
+            "limit": limit,
+            "total": len(documents),
+            "page": page,
+        }
+
+    def indexing_status(self, document: Dict[str, Any]) -> str:
+        elapsed = time.monotonic() - document["indexing_started_at"]
+        delay = self.config.indexing_delay_seconds
+        if elapsed >= delay:
+            return "completed"
+        return "waiting" if elapsed < delay / 4 else "indexing"
+
+    def public_document(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        public = {key: value for key, value in document.items() if key != "indexing_started_at"}
+        public["indexing_status"] = self.indexing_status(document)
+        public["display_status"] = "available" if public["indexing_status"] == "completed" else "indexing"
+        return public
+
+    # --- metadata ------------------------------------------------------
+
+    def list_metadata(self, dataset_id: str) -> Dict[str, Any]:
+        with self.lock:
+            fields = [dict(field) for field in self.metadata_fields.get(dataset_id, [])]
+        return {"doc_metadata": fields, "built_in_field_enabled": False}
+
+    def create_metadata(self, dataset_id: str, name: str, field_type: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            fields = self.metadata_fields.setdefault(dataset_id, [])
+            if any(field["name"] == name for field in fields):
+                return None
+            field = {"id": str(uuid4()), "name": name, "type": field_type or "string", "use_count": 0}
+            fields.append(field)
+            return dict(field)
+
+    def apply_metadata(self, dataset_id: str, operations: List[Dict[str, Any]]) -> Optional[str]:
+        with self.lock:
+            documents = self.documents.get(dataset_id, {})
+            for operation in operations:
+                document = documents.get(str(operation.get("document_id")))
+                if document is None:
+                    return str(operation.get("document_id"))
+                document["doc_metadata"] = list(operation.get("metadata_list") or [])
+        return None
+
+    # --- segments ------------------------------------------------------
+
+    def _segment(self, document_id: str, position: int, content: str, keywords: Optional[List[str]] = None) -> Dict[str, Any]:
+        return {
+            "id": str(uuid4()),
+            "document_id": document_id,
+            "position": position + 1,
+            "content": content,
+            "word_count": len(content.split()),
+            "keywords": list(keywords or []),
+            "status": "completed",
+            "enabled": True,
+        }
+
+    def list_segments(self, document_id: str) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [dict(segment) for segment in self.segments.get(document_id, [])]
+
+    def add_segments(self, document_id: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        with self.lock:
+            segments = self.segments.setdefault(document_id, [])
+            created = [
+                self._segment(document_id, len(segments) + index, str(item.get("content") or ""), item.get("keywords"))
+                for index, item in enumerate(items)
+            ]
+            segments.extend(created)
+            return [dict(segment) for segment in created]
+
+    def delete_segment(self, document_id: str, segment_id: str) -> bool:
+        with self.lock:
+            segments = self.segments.get(document_id, [])
+            for index, segment in enumerate(segments):
+                if segment["id"] == segment_id:
+                    del segments[index]
+                    return True
+        return False
+
+
+_ROUTES: List[Tuple[str, "re.Pattern[str]", str]] = [
+    ("POST", re.compile(r"^/datasets/([^/]+)/document/create[-_]by[-_]text$"), "create_by_text"),
+    ("POST", re.compile(r"^/datasets/([^/]+)/documents/([^/]+)/update[-_]by[-_]text$"), "update_by_text"),
+    ("GET", re.compile(r"^/datasets/([^/]+)/documents$"), "list_documents"),
+    ("POST", re.compile(r"^/datasets/([^/]+)/documents/metadata$"), "apply_metadata"),
+    ("GET", re.compile(r"^/datasets/([^/]+)/documents/([^/]+)/indexing-status$"), "indexing_status"),
+    ("GET", re.compile(r"^/datasets/([^/]+)/documents/([^/]+)/segments$"), "list_segments"),
+    ("POST", re.compile(r"^/datasets/([^/]+)/documents/([^/]+)/segments$"), "create_segments"),
+    ("DELETE", re.compile(r"^/datasets/([^/]+)/documents/([^/]+)/segments/([^/]+)$"), "delete_segment"),
+    ("GET", re.compile(r"^/datasets/([^/]+)/documents/([^/]+)$"), "get_document"),
+    ("GET", re.compile(r"^/datasets/([^/]+)/metadata$"), "list_metadata"),
+    ("POST", re.compile(r"^/datasets/([^/]+)/metadata$"), "create_metadata"),
+]
+
+
+class FakeKnowledgeBaseHandler(BaseHTTPRequestHandler):
+    server: "FakeKnowledgeBaseHTTPServer"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:  # noqa: N802
+        self._dispatch("GET")
+
+    def do_POST(self) -> None:  # noqa: N802
+        self._dispatch("POST")
+
+    def do_DELETE(self) -> None:  # noqa: N802
+        self._dispatch("DELETE")
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _dispatch(self, method: str) -> None:
+        state = self.server.state
+        url = urlsplit(self.path)
+        path = url.path[len(API_PREFIX) :] if url.path.startswith(API_PREFIX) else url.path
+        body = self._read_body()
+
+        if path == "/_stats" and method == "GET":
+            self._send(200, state.stats(), count=False)
+            return
+        if path == "/_reset" and method == "POST":
+            state.reset()
+            self._send(200, {"result": "success"}, count=False)
+            return
+
+        for route_method, pattern, action in _ROUTES:
+            match = pattern.match(path)
+            if match and route_method == method:
+                break
+        else:
+            self._send(404, {"code": "not_found", "message": f"No route for {method} {path}.", "status": 404}, "unknown")
+            return
+
+        endpoint = f"{method} {action}"
+        latency = state.latency_seconds()
+        if latency:
+            time.sleep(latency)
+
+        api_key = state.config.api_key
+        if api_key and self.headers.get("Authorization") != f"Bearer {api_key}":
+            self._send(401, {"code": "unauthorized", "message": "Invalid API key.", "status": 401}, endpoint)
+            return
+
+        fault = state.inject_fault()
+        if fault is not None:
+            status, payload = fault
+            headers = {"Retry-After": f"{state.config.retry_after_seconds:g}"} if status == 429 else None
+            self._send(status, payload, endpoint, headers)
+            return
+
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        status, payload = getattr(self, f"_{action}")(state, *match.groups(), body=body, query=query)
+        self._send(status, payload, endpoint)
+
+    # --- handlers ------------------------------------------------------
+
+    @staticmethod
+    def _create_by_text(state: FakeKnowledgeBaseState, dataset_id: str, *, body: Dict[str, Any], query: Dict[str, str]) -> Tuple[int, Any]:
+        name, text = body.get("name"), body.get("text")
+        if not name or not isinstance(text, str):
+            return 400, _error(400, "invalid_param", "name and text are required.")
+        document = state.save_document(dataset_id, None, str(name), text)
+        return 200, {"document": document, "batch": document["batch"]}
+
+    @staticmethod
+    def _update_by_text(state: FakeKnowledgeBaseState, dataset_id: str, document_id: str, *, body: Dict[str, Any], query: Dict[str, str]) -> Tuple[int, Any]:
+        existing = state.find_document(dataset_id, document_id)
+        if existing is None:
+            return 404, _error(404, "not_found", "Document not found.")
+        text = body.get("text")
+        if not isinstance(text, str):
+            return 400, _error(400, "invalid_param", "text is required.")
+        document = state.save_document(dataset_id, document_id, str(body.get("name") or existing["name"]), text)
+        return 200, {"document": document, "batch": document["batch"]}
+
+    @staticmethod
+    def _list_documents(state: FakeKnowledgeBaseState, dataset_id: str, *, body: Dict[str, Any], query: Dict[str, str]) -> Tuple[int, Any]:
+        page = max(1, _int(query.get("page"), 1))
+        limit = max(1, _int(query.get("limit"), 20))
+        return 200, state.list_documents(dataset_id, query.get("keyword") or "", page, limit)
+
+    @staticmethod
+    def _get_document(state: FakeKnowledgeBaseState, dataset_id: str, document_id: str, *, body: Dict[str, Any], query: Dict[str, str]) -> Tuple[int, Any]:
+        document = state.find_document(dataset_id, document_id)
+        if document is None:
+            return 404, _error(404, "not_found", "Document not found.")
+        return 200, document
+
+    @staticmethod
+    def _indexing_status(state: FakeKnowledgeBaseState, dataset_id: str, batch: str, *, body: Dict[str, Any], query: Dict[str, str]) -> Tuple[int, Any]:
+        documents = state.find_by_batch(dataset_id, batch)
+        if not documents:
+            return 404, _error(404, "not_found", "Documents not found.")
+        return 200, {
+            "data": [
+                {"id": document["id"], "indexing_status": document["indexing_status"]}
+                for document in documents
+            ]
+        }
+
+    @staticmethod
+    def _list_metadata(state: FakeKnowledgeBaseState, dataset_id: str, *, body: Dict[str, Any], query: Dict[str, str]) -> Tuple[int, Any]:
+        return 200, state.list_metadata(dataset_id)
+
+    @staticmethod
+    def _create_metadata(state: FakeKnowledgeBaseState, dataset_id: str, *, body: Dict[str, Any], query: Dict[str, str]) -> Tuple[int, Any]:
+        name = str(body.get("name") or "").strip()
+        if not name:
+            return 400, _error(400, "invalid_param", "name is required.")
+        field = state.create_metadata(dataset_id, name, str(body.get("type") or "string"))
+        if field is None:
+            return 400, _error(400, "invalid_param", f"Metadata name {name} already exists.")
+        return 201, field
+
+    @staticmethod
+    def _apply_metadata(state: FakeKnowledgeBaseState, dataset_id: str, *, body: Dict[str, Any], query: Dict[str, str]) -> Tuple[int, Any]:
+        operations = body.get("operation_data")
+        if not isinstance(operations, list):
+            return 400, _error(400, "invalid_param", "operation_data is required.")
+        missing = state.apply_metadata(dataset_id, operations)
+        if missing is not None:
+            return 404, _error(404, "not_found", f"Document {missing} not found.")
+        return 200, {"result": "success"}
+
+    @staticmethod
+    def _list_segments(state: FakeKnowledgeBaseState, dataset_id: str, document_id: str, *, body: Dict[str, Any], query: Dict[str, str]) -> Tuple[int, Any]:
+        if state.find_document(dataset_id, document_id) is None:
+            return 404, _error(404, "not_found", "Document not found.")
+        segments = state.list_segments(document_id)
+        return 200, {
+            "data": segments,
+            "doc_form": "text_model",
+            "has_more": False,
+            "limit": len(segments),
+            "total": len(segments),
+            "page": 1,
+        }
+
+    @staticmethod
+    def _create_segments(state: FakeKnowledgeBaseState, dataset_id: str, document_id: str, *, body: Dict[str, Any], query: Dict[str, str]) -> Tuple[int, Any]:
+        document = state.find_document(dataset_id, document_id)
+        if document is None:
+            return 404, _error(404, "not_found", "Document not found.")
+        if document["indexing_status"] != "completed":
+            return 400, _error(400, "invalid_param", "Document is not completed.")
+        items = body.get("segments")
+        if not isinstance(items, list) or not items:
+            return 400, _error(400, "invalid_param", "segments is required.")
+        return 200, {"data": state.add_segments(document_id, items), "doc_form": "text_model"}
+
+    @staticmethod
+    def _delete_segment(state: FakeKnowledgeBaseState, dataset_id: str, document_id: str, segment_id: str, *, body: Dict[str, Any], query: Dict[str, str]) -> Tuple[int, Any]:
+        if not state.delete_segment(document_id, segment_id):
+            return 404, _error(404, "not_found", "Segment not found.")
+        return 204, None
+
+    # --- plumbing ------------------------------------------------------
+
+    def _read_body(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+        return body if isinstance(body, dict) else {}
+
+    def _send(
+        self,
+        status: int,
+        payload: Any,
+        endpoint: str = "",
+        headers: Optional[Dict[str, str]] = None,
+        *,
+        count: bool = True,
+    ) -> None:
+        if count:
+            with self.server.state.lock:
+                self.server.state.counters[(endpoint, status)] += 1
+        content = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if content:
+            self.wfile.write(content)
+
+
+def _error(status: int, code: str, message: str) -> Dict[str, Any]:
+    return {"code": code, "message": message, "status": status}
+
+
+def _int(value: Any, default: int) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class FakeKnowledgeBaseHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], state: FakeKnowledgeBaseState, verbose: bool = False) -> None:
+        super().__init__(address, FakeKnowledgeBaseHandler)
+        self.state = state
+        self.verbose = verbose
+
+
+class FakeKnowledgeBase:
+    """Run the fake API on a background thread (port 0 picks a free port)."""
+
+    def __init__(
+        self,
+        config: Optional[FakeKnowledgeBaseConfig] = None,
+        *,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        verbose: bool = False,
+    ) -> None:
+        self.state = FakeKnowledgeBaseState(config or FakeKnowledgeBaseConfig())
+        self.httpd = FakeKnowledgeBaseHTTPServer((host, port), self.state, verbose)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def start(self) -> "FakeKnowledgeBase":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        return self.state.stats()
+
+    def __enter__(self) -> "FakeKnowledgeBase":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a 500 response")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="probability of a 429 response")
+    parser.add_argument("--requests-per-second", type=float, help="answer 429 above this request rate")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429")
+    parser.add_argument("--indexing-delay", type=float, default=0.0, help="seconds before documents complete")
+    parser.add_argument("--api-key", help="require this bearer token")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    config = FakeKnowledgeBaseConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        requests_per_second=args.requests_per_second,
+        retry_after_seconds=args.retry_after,
+        indexing_delay_seconds=args.indexing_delay,
+        api_key=args.api_key,
+        seed=args.seed,
+    )
+    server = FakeKnowledgeBase(config, host=args.host, port=args.port, verbose=args.verbose)
+    print(json.dumps({"base_url": server.base_url}))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,520 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from docfactory_core import (
+    KnowledgeBaseChunkCore,
+    KnowledgeBaseClient,
+    KnowledgeBaseDocumentCore,
+    KnowledgeBaseError,
+    RequestAttempts,
+    RetryPolicy,
+    assemble_metadata,
+    generate_document_name,
+    normalize_document_response,
+    normalize_upsert_mode,
+    parse_metadata,
+)
+
+
+class AsyncKnowledgeBaseClient(KnowledgeBaseClient):
+    """asyncio flavour of KnowledgeBaseClient with the same request() contract."""
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        *,
+        max_connections: int = 100,
+        pool_maxsize: Optional[int] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        rate_limit: Optional[float] = None,
+        dataset_rate_limit: Optional[float] = None,
+        breaker_threshold: Optional[int] = None,
+        breaker_cooldown: Optional[float] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        operation_deadline: Optional[float] = None,
+    ) -> None:
+        super().__init__(
+            base_url,
+            api_key,
+            pool_maxsize=pool_maxsize,
+            retry_policy=retry_policy,
+            rate_limit=rate_limit,
+            dataset_rate_limit=dataset_rate_limit,
+            breaker_threshold=breaker_threshold,
+            breaker_cooldown=breaker_cooldown,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            operation_deadline=operation_deadline,
+        )
+        # from_credentials() passes the http_pool_size credential as pool_maxsize.
+        if pool_maxsize not in (None, ""):
+            max_connections = self.pool_maxsize
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        self._http: Optional[httpx.AsyncClient] = None
+
+    async def __aenter__(self) -> "AsyncKnowledgeBaseClient":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        idempotent: Optional[bool] = None,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        path = self._normalize_path(path)
+        headers = self._build_headers(kwargs.pop("headers", {}))
+        params = kwargs.pop("params", None)
+        attempts = RequestAttempts(self, method, path, idempotent, kwargs.pop("timeout", None))
+        if self._http is None:
+            self._http = httpx.AsyncClient(limits=self._limits)
+        while True:
+            waited = attempts.before_attempt()
+            if waited:
+                await asyncio.sleep(waited)
+            timeout = attempts.attempt_timeout()
+            if isinstance(timeout, tuple):
+                timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+            try:
+                response = await self._http.request(
+                    method,
+                    attempts.url,
+                    headers=headers,
+                    params=params,
+                    timeout=timeout,
+                    **kwargs,
+                )
+            except httpx.HTTPError as exc:
+                delay = attempts.failed(
+                    exc,
+                    connect_failure=isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout)),
+                    timed_out=isinstance(exc, httpx.TimeoutException),
+                )
+            else:
+                delay = attempts.responded(response)
+                if delay is None:
+                    return self._parse_response(response, method, path)
+            await asyncio.sleep(delay)
+
+
+class AsyncKnowledgeBaseDocumentCore(KnowledgeBaseDocumentCore):
+    """Async counterpart of KnowledgeBaseDocumentCore (same upsert semantics)."""
+
+    client: AsyncKnowledgeBaseClient
+
+    async def save_text_document(
+        self,
+        *,
+        rendered_text: Any,
+        parameters: Dict[str, Any],
+        data_context: Any = None,
+    ) -> Dict[str, Any]:
+        with self.client.operation() as operation:
+            self.operation = operation
+            return await self._save_text_document(
+                rendered_text=rendered_text,
+                parameters=parameters,
+                data_context=data_context,
+            )
+
+    async def _save_text_document(
+        self,
+        *,
+        rendered_text: Any,
+        parameters: Dict[str, Any],
+        data_context: Any,
+    ) -> Dict[str, Any]:
+        dataset_id = self._resolve_dataset_id(parameters)
+        metadata_input = parse_metadata(parameters.get("metadata_json"))
+        metadata_payload = assemble_metadata(metadata_input)
+        upsert_mode = normalize_upsert_mode(parameters.get("upsert_mode"))
+        document_name = self._safe_str(parameters.get("document_name"))
+        document_id = self._safe_str(parameters.get("document_id"))
+        text = self._normalize_text(rendered_text)
+
+        resolved_id = await self._ensure_document_for_upsert(
+            dataset_id=dataset_id,
+            document_id=document_id,
+            document_name=document_name,
+            upsert_mode=upsert_mode,
+            rendered_text=text,
+            data_context=data_context,
+        )
+
+        summary = {
+            "saved_to_kb": True,
+            "dataset_id": dataset_id,
+            "document_id": resolved_id,
+            "metadata_applied": None,
+        }
+
+        if metadata_payload:
+            summary["metadata_applied"] = await self._apply_metadata(
+                dataset_id=dataset_id,
+                document_id=resolved_id,
+                metadata=metadata_payload,
+            )
+
+        return summary
+
+    async def _ensure_document_for_upsert(
+        self,
+        *,
+        dataset_id: str,
+        document_id: Optional[str],
+        document_name: Optional[str],
+        upsert_mode: str,
+        rendered_text: str,
+        data_context: Any,
+    ) -> str:
+        if document_id:
+            await self._assert_document_exists(dataset_id, document_id)
+            await self._update_document_by_text(
+                dataset_id=dataset_id,
+                document_id=document_id,
+                rendered_text=rendered_text,
+                document_name=document_name,
+            )
+            return document_id
+
+        if document_name:
+            existing = await self._find_document_by_name(dataset_id, document_name)
+            if existing:
+                if upsert_mode == "create_only":
+                    raise KnowledgeBaseError(
+                        "Document already exists but upsert_mode is create_only."
+                    )
+                target_id = self._extract_document_id(existing)
+                await self._update_document_by_text(
+                    dataset_id=dataset_id,
+                    document_id=target_id,
+                    rendered_text=rendered_text,
+                    document_name=document_name,
+                )
+                return target_id
+
+            if upsert_mode == "update_only":
+                raise KnowledgeBaseError(
+                    "Document not found and upsert_mode is update_only."
+                )
+
+            created = await self._create_document_by_text(
+                dataset_id=dataset_id,
+                document_name=document_name,
+                rendered_text=rendered_text,
+            )
+            return self._extract_document_id(created)
+
+        if upsert_mode == "update_only":
+            raise KnowledgeBaseError(
+                "document_name or document_id is required when upsert_mode is update_only."
+            )
+
+        created = await self._create_document_by_text(
+            dataset_id=dataset_id,
+            document_name=generate_document_name(data_context),
+            rendered_text=rendered_text,
+        )
+        return self._extract_document_id(created)
+
+    async def _create_document_by_text(
+        self,
+        *,
+        dataset_id: str,
+        document_name: str,
+        rendered_text: str,
+    ) -> Dict[str, Any]:
+        payload = {
+            "name": document_name,
+            "text": rendered_text,
+            "indexing_technique": "high_quality",
+            "process_rule": {"mode": "automatic"},
+        }
+        response = await self.client.request(
+            "POST",
+            f"/datasets/{dataset_id}/document/create-by-text",
+            json=payload,
+        )
+        document = normalize_document_response(response)
+        if "id" not in document and "document_id" not in document:
+            raise KnowledgeBaseError(
+                "Document creation succeeded but no identifier was returned."
+            )
+        return document
+
+    async def _update_document_by_text(
+        self,
+        *,
+        dataset_id: str,
+        document_id: str,
+        rendered_text: str,
+        document_name: Optional[str],
+    ) -> None:
+        payload: Dict[str, Any] = {"text": rendered_text}
+        if document_name:
+            payload["name"] = document_name
+        await self.client.request(
+            "POST",
+            f"/datasets/{dataset_id}/documents/{document_id}/update_by_text",
+            json=payload,
+            idempotent=True,
+        )
+
+    async def _apply_metadata(
+        self,
+        *,
+        dataset_id: str,
+        document_id: str,
+        metadata: Optional[Dict[str, Any]],
+    ) -> Optional[Dict[str, Any]]:
+        if not metadata:
+            return None
+
+        items = self._extract_metadata_items(
+            await self.client.request("GET", f"/datasets/{dataset_id}/metadata")
+        )
+        if not isinstance(items, list):
+            return metadata
+
+        name_to_id: Dict[str, str] = {}
+        self._merge_metadata_ids(items, name_to_id)
+        missing = [
+            str(key).strip()
+            for key in metadata.keys()
+            if str(key).strip() and str(key).strip() not in name_to_id
+        ]
+        # Missing definitions are independent of each other: create them concurrently.
+        created = await asyncio.gather(
+            *(self._create_metadata_field(dataset_id, name) for name in missing)
+        )
+        for name, new_id in zip(missing, created):
+            if new_id:
+                name_to_id[name] = new_id
+
+        items = self._extract_metadata_items(
+            await self.client.request("GET", f"/datasets/{dataset_id}/metadata")
+        )
+        if isinstance(items, list):
+            self._merge_metadata_ids(items, name_to_id)
+
+        payload = self._build_metadata_operation(document_id, metadata, name_to_id)
+        if payload is None:
+            return metadata
+
+        await self.client.request(
+            "POST",
+            f"/datasets/{dataset_id}/documents/metadata",
+            json=payload,
+            idempotent=True,
+        )
+        return metadata
+
+    async def _create_metadata_field(self, dataset_id: str, name: str) -> Optional[str]:
+        try:
+            create_resp = await self.client.request(
+                "POST",
+                f"/datasets/{dataset_id}/metadata",
+                json={
+                    "type": "string",
+                    "name": name,
+                },
+            )
+        except KnowledgeBaseError as exc:
+            if exc.status_code is None or exc.status_code >= 500:
+                raise
+            return None
+        if isinstance(create_resp, dict) and create_resp.get("id"):
+            return str(create_resp["id"])
+        return None
+
+    async def _find_document_by_name(
+        self,
+        dataset_id: str,
+        document_name: str,
+    ) -> Optional[Dict[str, Any]]:
+        response = await self.client.request(
+            "GET",
+            f"/datasets/{dataset_id}/documents",
+            params={"page": 1, "limit": 200, "keyword": document_name},
+        )
+        return self._match_document_by_name(response, document_name)
+
+    async def _assert_document_exists(self, dataset_id: str, document_id: str) -> Dict[str, Any]:
+        response = await self.client.request(
+            "GET",
+            f"/datasets/{dataset_id}/documents/{document_id}",
+        )
+        return self._check_document_response(response, dataset_id, document_id)
+
+
+class AsyncKnowledgeBaseChunkCore(KnowledgeBaseChunkCore):
+    """Async counterpart of KnowledgeBaseChunkCore; polling uses asyncio.sleep."""
+
+    client: AsyncKnowledgeBaseClient
+
+    async def _wait_for_completed(
+        self,
+        dataset_id: str,
+        document_id: str,
+        *,
+        timeout_seconds: int = 60,
+        poll_interval_seconds: int = 3,
+    ) -> Dict[str, Any]:
+        deadline = time.time() + timeout_seconds
+
+        while True:
+            document = await self._get_document(dataset_id, document_id)
+            last_status = self._check_indexing_status(document, document_id)
+            if last_status == "completed":
+                return document
+
+            if time.time() >= deadline:
+                raise KnowledgeBaseError(
+                    f"Timed out waiting for document {document_id} to complete; "
+                    f"last indexing_status was {last_status!r}."
+                )
+
+            slept_from = time.perf_counter()
+            await asyncio.sleep(self._poll_sleep(document_id, last_status, poll_interval_seconds))
+            self.sleep_seconds += time.perf_counter() - slept_from
+
+    async def replace_with_single_segment(
+        self,
+        *,
+        dataset_id: str,
+        document_id: str,
+        content: Any,
+        keywords: Optional[List[str]] = None,
+        timeout_seconds: int = 60,
+        poll_interval_seconds: int = 3,
+    ) -> Dict[str, Any]:
+        with self.client.operation() as operation:
+            self.operation = operation
+            return await self._replace_with_single_segment(
+                dataset_id=dataset_id,
+                document_id=document_id,
+                content=content,
+                keywords=keywords,
+                timeout_seconds=timeout_seconds,
+                poll_interval_seconds=poll_interval_seconds,
+            )
+
+    async def _replace_with_single_segment(
+        self,
+        *,
+        dataset_id: str,
+        document_id: str,
+        content: Any,
+        keywords: Optional[List[str]],
+        timeout_seconds: int,
+        poll_interval_seconds: int,
+    ) -> Dict[str, Any]:
+        await self._wait_for_completed(
+            dataset_id=dataset_id,
+            document_id=document_id,
+            timeout_seconds=timeout_seconds,
+            poll_interval_seconds=poll_interval_seconds,
+        )
+
+        normalized_content = content if isinstance(content, str) else str(content)
+
+        await self._update_document_text(
+            dataset_id=dataset_id,
+            document_id=document_id,
+            rendered_text=normalized_content,
+        )
+
+        await self._wait_for_completed(
+            dataset_id=dataset_id,
+            document_id=document_id,
+            timeout_seconds=timeout_seconds,
+            poll_interval_seconds=poll_interval_seconds,
+        )
+
+        segment_ids = await self._list_segments(dataset_id, document_id)
+        await asyncio.gather(
+            *(
+                self._delete_segment(dataset_id, document_id, segment_id)
+                for segment_id in segment_ids
+            )
+        )
+
+        await self.client.request(
+            "POST",
+            f"/datasets/{dataset_id}/documents/{document_id}/segments",
+            json=self._build_segment_payload(normalized_content, keywords),
+        )
+
+        return {
+            "dataset_id": dataset_id,
+            "document_id": document_id,
+            "converted_to_single_chunk": True,
+        }
+
+    async def _list_segments(self, dataset_id: str, document_id: str) -> List[str]:
+        response = await self.client.request(
+            "GET",
+            f"/datasets/{dataset_id}/documents/{document_id}/segments",
+        )
+        return self._extract_segment_ids(response)
+
+    async def _delete_segment(self, dataset_id: str, document_id: str, segment_id: str) -> None:
+        try:
+            await self.client.request(
+                "DELETE",
+                f"/datasets/{dataset_id}/documents/{document_id}/segments/{segment_id}",
+            )
+        except KnowledgeBaseError as exc:
+            if not self._is_segment_already_deleted(exc):
+                raise
+
+    async def _get_document(self, dataset_id: str, document_id: str) -> Dict[str, Any]:
+        return await self.client.request(
+            "GET",
+            f"/datasets/{dataset_id}/documents/{document_id}",
+        )
+
+    async def _update_document_text(
+        self,
+        *,
+        dataset_id: str,
+        document_id: str,
+        rendered_text: str,
+    ) -> None:
+        text_value = rendered_text if isinstance(rendered_text, str) else str(rendered_text)
+
+        name_value: str = document_id
+        try:
+            doc = await self._get_document(dataset_id, document_id)
+            name_value = self._extract_document_name(doc, name_value)
+        except KnowledgeBaseError:
+            pass
+
+        await self.client.request(
+            "POST",
+            f"/datasets/{dataset_id}/documents/{document_id}/update_by_text",
+            json={
+                "text": text_value,
+                "name": name_value,
+            },
+            idempotent=True,
+        )
@@ -1,15 +1,48 @@
 from __future__ import annotations
 
+import functools
+import hashlib
 import json
+import multiprocessing
+import os
+import random
 import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures.process import BrokenProcessPool
 from datetime import date, datetime
 from decimal import Decimal, InvalidOperation
-from typing import Any, Dict, List, Optional
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional
 from uuid import uuid4
 import time
+import weakref
 
+import jinja2
 import requests
-from jinja2 import BaseLoader, Environment, StrictUndefined, Undefined
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+from jinja2 import BaseLoader, BytecodeCache, Environment, StrictUndefined, Template, TemplateNotFound, Undefined
+from jinja2 import meta, nodes, pass_context
+from jinja2.runtime import Context
+from jinja2.sandbox import SandboxedEnvironment
+from jinja2.bccache import Bucket
+
+try:  # Optional accelerated JSON decoder.
+    import orjson
+except ImportError:  # pragma: no cover - depends on the runtime image
+    orjson = None
+
+
+JSON_DECODERS: Dict[str, Callable[[Any], Any]] = {"json": json.loads}
+if orjson is not None:
+    JSON_DECODERS["orjson"] = orjson.loads
+
+# Whitespace-only buffer check that works on memoryview without copying it.
+_BLANK_BYTES = re.compile(rb"\s*\Z")
 
 
 class KnowledgeBaseError(RuntimeError):
@@ -26,38 +59,773 @@ class KnowledgeBaseError(RuntimeError):
         self.payload = payload or {}
 
 
+class HTTPSessionPool:
+    """Thread-safe pool of keep-alive ``requests.Session`` objects.
+
+    One session per (base_url, api_key, pool size), shared by every client in
+    the worker process, so consecutive KB calls and tool invocations reuse
+    open TCP/TLS connections instead of handshaking on every request.
+    """
+
+    def __init__(self) -> None:
+        self._sessions: Dict[tuple, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def get(self, base_url: str, api_key: str, pool_maxsize: int) -> requests.Session:
+        # The key is hashed so the pool does not keep API keys in plain text.
+        key = (base_url, hashlib.sha256(api_key.encode("utf-8")).hexdigest(), pool_maxsize)
+        session = self._sessions.get(key)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._build_session(pool_maxsize)
+                self._sessions[key] = session
+            return session
+
+    @staticmethod
+    def _build_session(pool_maxsize: int) -> requests.Session:
+        session = requests.Session()
+        # Retries are handled by KnowledgeBaseClient, not by urllib3.
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=pool_maxsize,
+            max_retries=0,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def clear(self) -> None:
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` tokens per second, up to ``capacity``.
+
+    ``reserve()`` takes a token immediately and returns how long the caller
+    must wait before using it, so sync and async callers can sleep outside
+    the lock and waiting callers are served in arrival order.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class RateLimiterRegistry:
+    """Token buckets shared by every client in the worker process."""
+
+    def __init__(self) -> None:
+        self._buckets: Dict[tuple, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, rate: float) -> TokenBucket:
+        # The rate is part of the key so changed credentials take effect at once.
+        key = key + (rate,)
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            return bucket
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(rate)
+                self._buckets[key] = bucket
+            return bucket
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+class CircuitOpenError(KnowledgeBaseError):
+    """Raised without calling the API while the base URL's circuit is open."""
+
+
+class DeadlineExceededError(KnowledgeBaseError):
+    """Raised when a KB operation runs out of its end-to-end time budget."""
+
+
+class KnowledgeBaseOperation:
+    """State of one high-level KB operation (save, single chunk).
+
+    Holds the deadline, the retry budget and the operation's own call stats.
+    ``KnowledgeBaseClient.operation()`` makes it current through a ContextVar,
+    so concurrent operations sharing one pooled client (threads or asyncio
+    tasks) never reset each other's deadline or budget.
+    """
+
+    def __init__(self, deadline_seconds: float) -> None:
+        self.deadline_seconds = deadline_seconds
+        self.deadline = time.monotonic() + deadline_seconds
+        # Seconds of retry backoff spent, counted against RetryPolicy.total_budget_seconds.
+        self.retry_budget_used = 0.0
+        self.calls: List[Dict[str, Any]] = []
+        self.retry_count = 0
+        self.retry_sleep_seconds = 0.0
+        self.rate_limit_wait_seconds = 0.0
+
+    @staticmethod
+    def current() -> Optional["KnowledgeBaseOperation"]:
+        """The operation running in this thread / task (None outside operations)."""
+        return _ACTIVE_KB_OPERATION.get()
+
+    def time_remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def deadline_error(self, doing: str) -> DeadlineExceededError:
+        return DeadlineExceededError(
+            f"Operation deadline of {self.deadline_seconds:g}s exceeded {doing}."
+        )
+
+
+_ACTIVE_KB_OPERATION: ContextVar[Optional[KnowledgeBaseOperation]] = ContextVar(
+    "docfactory_kb_operation", default=None
+)
+
+
+class CircuitBreaker:
+    """Per-base-URL circuit breaker (closed -> open -> half-open -> closed).
+
+    ``failure_threshold`` consecutive failed attempts (connection errors,
+    timeouts, 5xx) open the circuit; calls then fail fast until
+    ``cooldown_seconds`` have passed. The first call after the cool-down is
+    let through as a probe (half-open): success closes the circuit, failure
+    opens it again for another cool-down.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, cooldown_seconds: float = 30.0) -> None:
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown_seconds = float(cooldown_seconds)
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                if now - self._opened_at < self.cooldown_seconds:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_started = now
+                return True
+            # Half-open: one probe at a time; a probe that never reported back
+            # (e.g. its worker died) is replaced after another cool-down.
+            if self._probe_started is None or now - self._probe_started >= self.cooldown_seconds:
+                self._probe_started = now
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_started = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.OPEN:
+                # Calls sent before the circuit opened fail late; they must
+                # not extend the cool-down.
+                return
+            self._probe_started = None
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def is_open(self) -> bool:
+        """True while calls fail fast; unlike allow_request() it never starts a probe."""
+        return self.retry_in() > 0
+
+    def retry_in(self) -> float:
+        """Seconds until an open circuit lets a probe through (0 otherwise)."""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.cooldown_seconds - (time.monotonic() - self._opened_at))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "cooldown_seconds": self.cooldown_seconds,
+            "retry_in_seconds": round(self.retry_in(), 3),
+        }
+
+
+class CircuitBreakerRegistry:
+    """Circuit breakers shared by every client in the worker process."""
+
+    def __init__(self) -> None:
+        self._breakers: Dict[tuple, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, base_url: str, failure_threshold: int, cooldown_seconds: float) -> CircuitBreaker:
+        # Thresholds are part of the key so changed credentials take effect at once.
+        key = (base_url, failure_threshold, cooldown_seconds)
+        breaker = self._breakers.get(key)
+        if breaker is not None:
+            return breaker
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(failure_threshold, cooldown_seconds)
+                self._breakers[key] = breaker
+            return breaker
+
+    def clear(self) -> None:
+        with self._lock:
+            self._breakers.clear()
+
+
+class RetryPolicy:
+    """When and how long to wait before retrying a failed KB API call.
+
+    Backoff is exponential with full jitter (a uniform draw between 0 and
+    ``base_delay * 2 ** (retry - 1)``, capped at ``max_delay``); a
+    ``Retry-After`` header raises the wait to at least the server's value.
+    Only idempotent methods are retried after the server may have acted on
+    the request: 429 and connection failures before sending are safe for
+    every method, 5xx responses and read errors only for idempotent ones.
+    ``total_budget_seconds`` caps the time slept on retries per operation.
+    """
+
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+    IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+    def __init__(
+        self,
+        *,
+        max_retries: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        total_budget_seconds: float = 20.0,
+    ) -> None:
+        self.max_retries = max(0, int(max_retries))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.total_budget_seconds = total_budget_seconds
+
+    def is_idempotent(self, method: str) -> bool:
+        return method.upper() in self.IDEMPOTENT_METHODS
+
+    def should_retry(
+        self,
+        idempotent: bool,
+        *,
+        status: Optional[int] = None,
+        request_sent: bool = True,
+    ) -> bool:
+        if status is not None:
+            if status == 429:
+                return True
+            return idempotent and status in self.RETRY_STATUSES
+        return idempotent or not request_sent
+
+    def backoff(self, retry_number: int) -> float:
+        ceiling = min(self.max_delay, self.base_delay * (2 ** max(0, retry_number - 1)))
+        return random.uniform(0, ceiling)
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """Seconds from a ``Retry-After`` header (delta-seconds or HTTP date)."""
+        if not value:
+            return None
+        value = value.strip()
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            moment = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, moment.timestamp() - time.time())
+
+
+class RequestAttempts:
+    """Per-attempt decisions of one ``request`` call, shared by the sync and async clients.
+
+    The clients only send the request and sleep; the breaker check, rate
+    limiting, deadline clamp, call records and retry decisions live here.
+    """
+
+    def __init__(
+        self,
+        client: "KnowledgeBaseClient",
+        method: str,
+        path: str,
+        idempotent: Optional[bool],
+        timeout: Any,
+    ) -> None:
+        self.client = client
+        self.operation = KnowledgeBaseOperation.current()
+        self.method = method
+        self.path = path
+        self.url = f"{client.base_url}{path}"
+        if idempotent is None:
+            idempotent = client.retry_policy.is_idempotent(method)
+        self.idempotent = idempotent
+        self.timeout = timeout or (client.connect_timeout, client.read_timeout)
+        self.endpoint = f"before {method.upper()} {path} completed"
+        self.attempt = 1
+        self.waited = 0.0
+        self.clamped = False
+        self.started = 0.0
+        # Why the previous attempt failed; reported if this call's retries open the circuit.
+        self.last_error: Optional[Exception] = None
+
+    def before_attempt(self) -> float:
+        """Fail fast on an open circuit; return the rate-limit wait for this attempt."""
+        self.client._check_circuit(self.last_error)
+        self.waited = self.client._rate_limit_delay(self.path, self.endpoint, self.operation)
+        return self.waited
+
+    def attempt_timeout(self) -> Any:
+        """The (connect, read) timeout for the attempt about to be sent."""
+        timeout, self.clamped = self.client._attempt_timeout(
+            self.timeout, self.endpoint, self.operation
+        )
+        self.started = time.perf_counter()
+        return timeout
+
+    def failed(self, exc: Exception, *, connect_failure: bool, timed_out: bool) -> float:
+        """Record a transport error; return the retry delay or raise the final error."""
+        client = self.client
+        client._record_call(
+            self.method, self.path, self.started, None, self.attempt, self.waited, self.operation
+        )
+        # A timeout cut short by the deadline says nothing about API health.
+        deadline_cut = self.clamped and timed_out
+        if not deadline_cut:
+            client._record_outcome(None)
+            client._check_circuit_opened(exc)
+        delay = client._retry_delay(
+            self.idempotent, self.attempt, self.operation, request_sent=not connect_failure
+        )
+        if delay is None:
+            if deadline_cut:
+                raise self.operation.deadline_error(self.endpoint) from exc
+            raise KnowledgeBaseError(f"Request to {self.url} failed: {exc}") from exc
+        self.last_error = exc
+        self.attempt += 1
+        return delay
+
+    def responded(self, response: Any) -> Optional[float]:
+        """Record a response; return the retry delay, or None when it is final."""
+        client = self.client
+        client._record_call(
+            self.method, self.path, self.started, response, self.attempt, self.waited, self.operation
+        )
+        client._record_outcome(response.status_code)
+        if response.status_code in client.retry_policy.RETRY_STATUSES:
+            try:
+                client._parse_response(response, self.method, self.path)
+            except KnowledgeBaseError as exc:
+                self.last_error = exc
+            client._check_circuit_opened(self.last_error)
+        delay = client._retry_delay(
+            self.idempotent,
+            self.attempt,
+            self.operation,
+            status=response.status_code,
+            retry_after=response.headers.get("Retry-After"),
+        )
+        if delay is not None:
+            self.attempt += 1
+        return delay
+
+
 class KnowledgeBaseClient:
     """Thin wrapper around the Dify Knowledge Base HTTP API."""
 
-    def __init__(self, base_url: str, api_key: str) -> None:
+    DEFAULT_POOL_MAXSIZE = 10
+    DEFAULT_BREAKER_THRESHOLD = 5
+    DEFAULT_BREAKER_COOLDOWN_SECONDS = 30.0
+    DEFAULT_CONNECT_TIMEOUT = 5.0
+    DEFAULT_READ_TIMEOUT = 30.0
+    # End-to-end budget per save / single-chunk operation. The plugin runtime
+    # kills requests after MAX_REQUEST_TIMEOUT (120 s, see main.py), so the
+    # budget is capped below it to fail with a clear error instead.
+    DEFAULT_OPERATION_DEADLINE_SECONDS = 100.0
+    MAX_OPERATION_DEADLINE_SECONDS = 115.0
+    # Do not start an HTTP attempt with less time than this left.
+    MIN_ATTEMPT_SECONDS = 0.1
+
+    # Shared by every client in the worker process.
+    session_pool = HTTPSessionPool()
+    rate_limiters = RateLimiterRegistry()
+    circuit_breakers = CircuitBreakerRegistry()
+
+    _DATASET_PATH = re.compile(r"^/datasets/([^/]+)")
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        *,
+        pool_maxsize: Optional[int] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        rate_limit: Optional[float] = None,
+        dataset_rate_limit: Optional[float] = None,
+        breaker_threshold: Optional[int] = None,
+        breaker_cooldown: Optional[float] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        operation_deadline: Optional[float] = None,
+    ) -> None:
         self.base_url = (base_url or "").rstrip("/")
         self.api_key = api_key or ""
         if not self.base_url:
             raise KnowledgeBaseError("dify_api_base_url must be configured.")
         if not self.api_key:
             raise KnowledgeBaseError("dify_api_key must be configured.")
+        self.pool_maxsize = _positive_int_or(pool_maxsize, self.DEFAULT_POOL_MAXSIZE)
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Requests per second towards the whole API and towards one dataset; None disables.
+        self.rate_limit = _positive_float_or(rate_limit, None)
+        self.dataset_rate_limit = _positive_float_or(dataset_rate_limit, None)
+        self.rate_limit_wait_seconds = 0.0
+        # Consecutive failures that open the base URL's circuit; 0 disables the breaker.
+        threshold = _positive_int_or(breaker_threshold, self.DEFAULT_BREAKER_THRESHOLD, allow_zero=True)
+        self.circuit_breaker: Optional[CircuitBreaker] = None
+        if threshold:
+            self.circuit_breaker = self.circuit_breakers.get(
+                self.base_url,
+                threshold,
+                _positive_float_or(breaker_cooldown, self.DEFAULT_BREAKER_COOLDOWN_SECONDS),
+            )
+        self.connect_timeout = _positive_float_or(connect_timeout, self.DEFAULT_CONNECT_TIMEOUT)
+        self.read_timeout = _positive_float_or(read_timeout, self.DEFAULT_READ_TIMEOUT)
+        self.operation_deadline = min(
+            _positive_float_or(operation_deadline, self.DEFAULT_OPERATION_DEADLINE_SECONDS),
+            self.MAX_OPERATION_DEADLINE_SECONDS,
+        )
+        # Totals over every call made through this client; each operation
+        # keeps its own copy (see KnowledgeBaseOperation) for timings output.
+        self.calls: List[Dict[str, Any]] = []
+        self.retry_count = 0
+        self.retry_sleep_seconds = 0.0
+
+    @classmethod
+    def from_credentials(cls, credentials: Dict[str, Any]) -> "KnowledgeBaseClient":
+        """Build a client from the provider credentials (base URL, key and tuning)."""
+        return cls(
+            (credentials.get("dify_api_base_url") or "").strip(),
+            (credentials.get("dify_api_key") or "").strip(),
+            pool_maxsize=credentials.get("http_pool_size"),
+            retry_policy=RetryPolicy(
+                max_retries=_positive_int_or(credentials.get("http_max_retries"), 3, allow_zero=True),
+            ),
+            rate_limit=credentials.get("rate_limit_per_second"),
+            dataset_rate_limit=credentials.get("dataset_rate_limit_per_second"),
+            breaker_threshold=credentials.get("circuit_breaker_threshold"),
+            breaker_cooldown=credentials.get("circuit_breaker_cooldown_seconds"),
+            connect_timeout=credentials.get("http_connect_timeout"),
+            read_timeout=credentials.get("http_read_timeout"),
+            operation_deadline=credentials.get("operation_deadline_seconds"),
+        )
+
+    @contextmanager
+    def operation(self, deadline_seconds: Optional[float] = None) -> Iterator[KnowledgeBaseOperation]:
+        """Run one high-level KB operation with a fresh retry budget and deadline.
+
+        Every HTTP attempt, retry wait and rate-limit wait inside the block is
+        clamped to the time left before the deadline.
+        """
+        budget = min(
+            _positive_float_or(deadline_seconds, self.operation_deadline),
+            self.MAX_OPERATION_DEADLINE_SECONDS,
+        )
+        operation = KnowledgeBaseOperation(budget)
+        token = _ACTIVE_KB_OPERATION.set(operation)
+        try:
+            yield operation
+        finally:
+            _ACTIVE_KB_OPERATION.reset(token)
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        idempotent: Optional[bool] = None,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        """Send one API call, retrying transient failures per ``retry_policy``.
 
-    def request(self, method: str, path: str, **kwargs: Any) -> Dict[str, Any]:
-        path = path if path.startswith("/") else f"/{path}"
-        url = f"{self.base_url}{path}"
-        headers = kwargs.pop("headers", {})
+        ``idempotent`` overrides the method-based default for calls whose
+        effect does not change when repeated (e.g. POST update_by_text).
+        """
+        path = self._normalize_path(path)
+        headers = self._build_headers(kwargs.pop("headers", {}))
+        params = kwargs.pop("params", None)
+        attempts = RequestAttempts(self, method, path, idempotent, kwargs.pop("timeout", None))
+        session = self.session_pool.get(self.base_url, self.api_key, self.pool_maxsize)
+        while True:
+            waited = attempts.before_attempt()
+            if waited:
+                time.sleep(waited)
+            timeout = attempts.attempt_timeout()
+            try:
+                response = session.request(
+                    method=method,
+                    url=attempts.url,
+                    headers=headers,
+                    params=params,
+                    timeout=timeout,
+                    **kwargs,
+                )
+            except requests.RequestException as exc:
+                delay = attempts.failed(
+                    exc,
+                    connect_failure=self._is_connect_failure(exc),
+                    timed_out=isinstance(exc, requests.Timeout),
+                )
+            else:
+                delay = attempts.responded(response)
+                if delay is None:
+                    return self._parse_response(response, method, path)
+            time.sleep(delay)
+
+    def _check_circuit(self, last_error: Optional[Exception] = None) -> None:
+        """Fail fast, without touching the network, while the circuit is open.
+
+        ``last_error`` is the failure of the in-flight call's previous attempt;
+        when that call's own retries opened the circuit it is the real cause,
+        so it is kept in the message and chained.
+        """
+        breaker = self.circuit_breaker
+        if breaker is None or breaker.allow_request():
+            return
+        raise self._circuit_open_error(breaker, last_error) from last_error
+
+    def _check_circuit_opened(self, last_error: Optional[Exception]) -> None:
+        """Raise right after a failure opened the circuit, instead of sleeping a backoff first."""
+        breaker = self.circuit_breaker
+        if breaker is not None and breaker.is_open():
+            raise self._circuit_open_error(breaker, last_error) from last_error
+
+    def _circuit_open_error(
+        self, breaker: CircuitBreaker, last_error: Optional[Exception]
+    ) -> CircuitOpenError:
+        message = (
+            f"Dify API at {self.base_url} is unavailable: circuit breaker open after "
+            f"{breaker.consecutive_failures} consecutive failures, "
+            f"next attempt allowed in {breaker.retry_in():.1f}s."
+        )
+        if last_error is not None:
+            message = f"{message} Last error: {last_error}"
+        return CircuitOpenError(
+            message,
+            status_code=getattr(last_error, "status_code", None),
+            payload={"circuit_breaker": breaker.snapshot()},
+        )
+
+    def _record_outcome(self, status: Optional[int]) -> None:
+        # Connection errors, timeouts and 5xx count as failures; any other
+        # response (4xx and 429 included) proves the API is reachable.
+        breaker = self.circuit_breaker
+        if breaker is None:
+            return
+        if status is None or status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def circuit_state(self) -> Optional[Dict[str, Any]]:
+        """Breaker snapshot for tool outputs (None when the breaker is disabled)."""
+        return self.circuit_breaker.snapshot() if self.circuit_breaker is not None else None
+
+    def _attempt_timeout(
+        self, timeout: Any, endpoint: str, operation: Optional[KnowledgeBaseOperation] = None
+    ) -> tuple:
+        """Clamp the (connect, read) timeout to the deadline; return it and whether it was cut."""
+        if operation is None:
+            return timeout, False
+        remaining = operation.time_remaining()
+        if remaining < self.MIN_ATTEMPT_SECONDS:
+            raise operation.deadline_error(endpoint)
+        if isinstance(timeout, tuple):
+            limited = tuple(min(float(part), remaining) for part in timeout)
+        else:
+            limited = min(float(timeout), remaining)
+        return limited, limited != timeout
+
+    def _rate_limit_delay(
+        self, path: str, endpoint: str = "", operation: Optional[KnowledgeBaseOperation] = None
+    ) -> float:
+        """Reserve a token in every applicable bucket; return the seconds to wait."""
+        delay = 0.0
+        if self.rate_limit:
+            bucket = self.rate_limiters.get(("base", self.base_url), self.rate_limit)
+            delay = bucket.reserve()
+        if self.dataset_rate_limit:
+            match = self._DATASET_PATH.match(path)
+            if match:
+                bucket = self.rate_limiters.get(
+                    ("dataset", self.base_url, match.group(1)), self.dataset_rate_limit
+                )
+                delay = max(delay, bucket.reserve())
+        # The token is already reserved, so the wait cannot be shortened.
+        if operation is not None and delay:
+            if delay > self.wait_allowance(operation):
+                raise operation.deadline_error(f"waiting for the rate limiter {endpoint}".rstrip())
+            operation.rate_limit_wait_seconds += delay
+        self.rate_limit_wait_seconds += delay
+        return delay
+
+    def wait_allowance(self, operation: KnowledgeBaseOperation) -> float:
+        """Longest wait that still leaves time for one more attempt before the deadline."""
+        # MIN_ATTEMPT_SECONDS for the attempt, and as much again as slack for
+        # sleep overshoot and the work between the wait and the send.
+        return operation.time_remaining() - 2 * self.MIN_ATTEMPT_SECONDS
+
+    def _retry_delay(
+        self,
+        idempotent: bool,
+        attempt: int,
+        operation: Optional[KnowledgeBaseOperation] = None,
+        *,
+        status: Optional[int] = None,
+        retry_after: Optional[str] = None,
+        request_sent: bool = True,
+    ) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to stop retrying."""
+        policy = self.retry_policy
+        if status is not None and status not in policy.RETRY_STATUSES:
+            return None
+        if attempt > policy.max_retries:
+            return None
+        if not policy.should_retry(idempotent, status=status, request_sent=request_sent):
+            return None
+        delay = policy.backoff(attempt)
+        server_delay = policy.parse_retry_after(retry_after)
+        if server_delay is not None:
+            delay = max(delay, server_delay)
+        if operation is not None:
+            # Backoff is shortened to the time left; a longer Retry-After is not,
+            # as retrying before it would only be throttled again.
+            allowance = self.wait_allowance(operation)
+            if allowance <= 0 or (server_delay is not None and server_delay > allowance):
+                return None
+            delay = min(delay, allowance)
+            if operation.retry_budget_used + delay > policy.total_budget_seconds:
+                return None
+            operation.retry_budget_used += delay
+            operation.retry_count += 1
+            operation.retry_sleep_seconds += delay
+        elif delay > policy.total_budget_seconds:
+            return None
+        self.retry_count += 1
+        self.retry_sleep_seconds += delay
+        return delay
+
+    @staticmethod
+    def _is_connect_failure(exc: Exception) -> bool:
+        """True when the request never reached the server (safe to resend)."""
+        if isinstance(exc, requests.ConnectTimeout):
+            return True
+        reason = exc.args[0] if exc.args else None
+        return isinstance(reason, MaxRetryError) and isinstance(reason.reason, NewConnectionError)
+
+    def _record_call(
+        self,
+        method: str,
+        path: str,
+        started: float,
+        response: Any,
+        attempt: int = 1,
+        rate_limit_wait: float = 0.0,
+        operation: Optional[KnowledgeBaseOperation] = None,
+    ) -> None:
+        call = {
+            "endpoint": f"{method.upper()} {path}",
+            "status": getattr(response, "status_code", None),
+            "attempt": attempt,
+            "rate_limit_wait_ms": round(rate_limit_wait * 1000, 3),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            "request_bytes": self._body_size(getattr(response, "request", None)),
+            "response_bytes": len(response.content or b"") if response is not None else 0,
+        }
+        self.calls.append(call)
+        if operation is not None:
+            operation.calls.append(call)
+
+    @staticmethod
+    def _body_size(request: Any) -> int:
+        # requests exposes the sent body as PreparedRequest.body, httpx as Request.content.
+        try:
+            body = getattr(request, "body", None)
+            if body is None:
+                body = getattr(request, "content", None)
+        except Exception:
+            return 0
+        if isinstance(body, str):
+            return len(body.encode("utf-8"))
+        return len(body) if isinstance(body, (bytes, bytearray)) else 0
+
+    def timing_summary(self, operation: Optional[KnowledgeBaseOperation] = None) -> Dict[str, Any]:
+        """Call stats of ``operation``, or this client's totals when it is None."""
+        stats: Any = operation if operation is not None else self
+        return {
+            "http_call_count": len(stats.calls),
+            "http_ms": round(sum(call["duration_ms"] for call in stats.calls), 3),
+            "retries": stats.retry_count,
+            "retry_sleep_ms": round(stats.retry_sleep_seconds * 1000, 3),
+            "rate_limit_wait_ms": round(stats.rate_limit_wait_seconds * 1000, 3),
+            "deadline_ms": round(operation.deadline_seconds * 1000, 3) if operation is not None else None,
+            "deadline_remaining_ms": round(max(0.0, operation.time_remaining()) * 1000, 3)
+            if operation is not None
+            else None,
+            "http_calls": list(stats.calls),
+        }
+
+    @staticmethod
+    def _normalize_path(path: str) -> str:
+        return path if path.startswith("/") else f"/{path}"
+
+    def _build_headers(self, headers: Dict[str, str]) -> Dict[str, str]:
         headers.setdefault("Authorization", f"Bearer {self.api_key}")
         headers.setdefault("Content-Type", "application/json")
         headers.setdefault("Accept", "application/json")
-        params = kwargs.pop("params", None)
-        timeout = kwargs.pop("timeout", 30)
-        try:
-            response = requests.request(
-                method=method,
-                url=url,
-                headers=headers,
-                params=params,
-                timeout=timeout,
-                **kwargs,
-            )
-        except requests.RequestException as exc:
-            raise KnowledgeBaseError(f"Request to {url} failed: {exc}") from exc
+        return headers
 
+    @staticmethod
+    def _parse_response(response: Any, method: str, path: str) -> Dict[str, Any]:
+        """Translate a requests/httpx response into the client's return contract."""
         if response.status_code >= 400:
             payload: Optional[Dict[str, Any]] = None
             detail: str
@@ -80,86 +848,1209 @@ class KnowledgeBaseClient:
             return {}
 
 
+def _positive_int_or(value: Any, default: int, *, allow_zero: bool = False) -> int:
+    """Parse optional numeric settings (credentials arrive as strings)."""
+    try:
+        number = int(str(value).strip()) if value not in (None, "") else default
+    except ValueError:
+        return default
+    return number if number > 0 or (allow_zero and number == 0) else default
+
+
+def _positive_float_or(value: Any, default: Optional[float]) -> Optional[float]:
+    try:
+        number = float(str(value).strip()) if value not in (None, "") else default
+    except ValueError:
+        return default
+    return number if number is not None and number > 0 else default
+
+
+class CurrencyFormatter:
+    """Formats amounts for one (currency, decimals, style) combination.
+
+    The quantize exponent, format spec and separator replacements are built
+    once; use ``get_currency_formatter`` to share instances across renders.
+    Amounts still go through Decimal so rounding matches the original filter.
+    """
+
+    # style -> (thousands separator, decimal separator)
+    STYLES: Dict[str, tuple] = {
+        "eu": (".", ","),
+        "us": (",", "."),
+        "ch": ("'", "."),
+        "fr": (" ", ","),
+        "plain": ("", "."),
+    }
+
+    __slots__ = ("exponent", "spec", "replacements", "suffix")
+
+    def __init__(self, currency: str, decimals: int, style: str) -> None:
+        if style not in self.STYLES:
+            raise ValueError(
+                f"Unknown currency style {style!r}; available: {', '.join(sorted(self.STYLES))}."
+            )
+        thousands, decimal_separator = self.STYLES[style]
+        self.exponent = Decimal(10) ** -decimals
+        self.spec = f",.{decimals}f" if thousands else f".{decimals}f"
+        if decimal_separator == ".":
+            replacements = [(",", thousands)] if thousands not in ("", ",") else []
+        elif not thousands:
+            replacements = [(".", decimal_separator)]
+        else:
+            replacements = [(",", "\0"), (".", decimal_separator), ("\0", thousands)]
+        self.replacements = tuple(replacements)
+        self.suffix = f" {currency}".rstrip() if currency else ""
+
+    def format(self, value: Any) -> str:
+        if value is None or value == "":
+            return ""
+        if isinstance(value, Decimal):
+            amount = value
+        else:
+            try:
+                amount = Decimal(value if isinstance(value, str) else str(value))
+            except (InvalidOperation, ValueError):
+                return str(value)
+
+        formatted = format(amount.quantize(self.exponent), self.spec)
+        for old, new in self.replacements:
+            formatted = formatted.replace(old, new)
+        return formatted + self.suffix
+
+
+@functools.lru_cache(maxsize=256)
+def get_currency_formatter(currency: str = "EUR", decimals: int = 2, style: str = "eu") -> CurrencyFormatter:
+    return CurrencyFormatter(currency, int(decimals), style)
+
+
+def register_currency_style(name: str, thousands_separator: str, decimal_separator: str) -> None:
+    """Add (or replace) a separator convention usable as ``style`` in format_currency."""
+    CurrencyFormatter.STYLES[name] = (thousands_separator, decimal_separator)
+    get_currency_formatter.cache_clear()
+
+
+def _parse_day_first_date(value: str) -> datetime:
+    return datetime(int(value[6:10]), int(value[3:5]), int(value[0:2]))
+
+
+def _parse_iso_datetime(value: str) -> datetime:
+    if value[-1:] in ("Z", "z"):
+        value = f"{value[:-1]}+00:00"
+    return datetime.fromisoformat(value)
+
+
+def _strptime_parser(date_format: str) -> Callable[[str], datetime]:
+    def parse(value: str) -> datetime:
+        return datetime.strptime(value, date_format)
+
+    return parse
+
+
+# Fallback chain for strings whose shape has not been seen yet, in the order
+# format_date has always tried them.
+_DATE_PARSER_CHAIN: tuple = (
+    _strptime_parser("%Y-%m-%d"),
+    _strptime_parser("%Y-%m-%dT%H:%M:%S"),
+    _strptime_parser("%d/%m/%Y"),
+    _parse_iso_datetime,
+)
+_DATE_SHAPE_TABLE = str.maketrans("0123456789", "9999999999")
+_MAX_DATE_SHAPES = 256
+# Shape (digits masked as "9") -> parser known to handle it; grows as new
+# shapes are parsed successfully through the fallback chain.
+_DATE_SHAPE_PARSERS: Dict[str, Callable[[str], datetime]] = {
+    "9999-99-99": datetime.fromisoformat,
+    "9999-99-99T99:99:99": datetime.fromisoformat,
+    "99/99/9999": _parse_day_first_date,
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_date_string(value: str) -> Optional[datetime]:
+    """Parse a stripped date string, or return None when no format matches."""
+    shape = value.translate(_DATE_SHAPE_TABLE)
+    parser = _DATE_SHAPE_PARSERS.get(shape)
+    if parser is not None:
+        try:
+            return parser(value)
+        except ValueError:
+            pass
+
+    for parser in _DATE_PARSER_CHAIN:
+        try:
+            parsed = parser(value)
+        except ValueError:
+            continue
+        if len(_DATE_SHAPE_PARSERS) < _MAX_DATE_SHAPES:
+            _DATE_SHAPE_PARSERS.setdefault(shape, parser)
+        return parsed
+    return None
+
+
+class CompiledTemplate:
+    """A compiled template plus the top-level context names it reads.
+
+    ``referenced_names`` is ``None`` when the template pulls in other templates
+    (include/import/extends): those see the whole context, so it cannot be pruned.
+    """
+
+    __slots__ = ("template", "referenced_names")
+
+    def __init__(self, template: Template, referenced_names: Optional[FrozenSet[str]]) -> None:
+        self.template = template
+        self.referenced_names = referenced_names
+
+    @classmethod
+    def from_ast(cls, template: Template, ast: nodes.Template) -> "CompiledTemplate":
+        return cls(template, cls.names_from_ast(ast))
+
+    @staticmethod
+    def names_from_ast(ast: nodes.Template) -> Optional[FrozenSet[str]]:
+        if any(ast.find_all((nodes.Include, nodes.Import, nodes.FromImport, nodes.Extends))):
+            return None
+        return frozenset(meta.find_undeclared_variables(ast))
+
+    def select_context(self, data_context: Any) -> Any:
+        """Keep only the top-level keys the template references."""
+        names = self.referenced_names
+        if names is None or not isinstance(data_context, dict):
+            return data_context
+        return {key: data_context[key] for key in names if key in data_context}
+
+    def context_stats(self, data_context: Any) -> Optional[Dict[str, int]]:
+        if self.referenced_names is None or not isinstance(data_context, dict):
+            return None
+        used = sum(1 for key in self.referenced_names if key in data_context)
+        return {
+            "context_keys": len(data_context),
+            "context_keys_used": used,
+            "context_keys_skipped": len(data_context) - used,
+        }
+
+
+class TemplateCache:
+    """Bounded, thread-safe LRU of compiled Jinja2 templates."""
+
+    def __init__(self, max_size: int = 256) -> None:
+        self.max_size = max(1, int(max_size))
+        self._entries: "OrderedDict[str, CompiledTemplate]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[CompiledTemplate]:
+        with self._lock:
+            template = self._entries.get(key)
+            if template is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return template
+
+    def put(self, key: str, template: CompiledTemplate) -> None:
+        with self._lock:
+            self._entries[key] = template
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class EnvironmentPool:
+    """Thread-safe pool holding one long-lived Environment per option set."""
+
+    def __init__(self) -> None:
+        self._environments: Dict[tuple, Environment] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        options: Dict[str, Any],
+        factory: Callable[[Dict[str, Any]], Environment],
+    ) -> Environment:
+        key = tuple(sorted(options.items()))
+        env = self._environments.get(key)
+        if env is not None:
+            return env
+        with self._lock:
+            env = self._environments.get(key)
+            if env is None:
+                env = factory(options)
+                self._environments[key] = env
+            return env
+
+    def clear(self) -> None:
+        with self._lock:
+            self._environments.clear()
+
+    def __len__(self) -> int:
+        return len(self._environments)
+
+
+class PluginStorageBytecodeCache(BytecodeCache):
+    """Jinja2 bytecode cache persisted in the Dify plugin storage.
+
+    Entries are keyed by template hash and Jinja2 version and tracked in a
+    small JSON index so the least recently used ones can be evicted before the
+    cache outgrows its share of the storage quota declared in manifest.yaml.
+    The index also keeps each template's referenced names (set on the bucket
+    as ``referenced_names`` before dumping), so a bytecode hit needs no parse.
+    """
+
+    # Index entries written before names were stored, or buckets without them.
+    NAMES_UNKNOWN = object()
+
+    KEY_PREFIX = "docfactory_bcc_"
+    INDEX_KEY = "docfactory_bcc_index"
+    # manifest.yaml grants 1 MiB of plugin storage; bytecode may use half of it.
+    MAX_TOTAL_BYTES = 512 * 1024
+
+    def __init__(self, storage: Any, max_total_bytes: Optional[int] = None) -> None:
+        self.storage = storage
+        self.max_total_bytes = max_total_bytes or self.MAX_TOTAL_BYTES
+        self._loaded_names: Dict[str, Any] = {}
+
+    def referenced_names(self, bucket: Bucket) -> Any:
+        """Names stored with a loaded bucket (a frozenset, None or NAMES_UNKNOWN)."""
+        return self._loaded_names.get(bucket.key, self.NAMES_UNKNOWN)
+
+    def get_cache_key(self, name: str, filename: Optional[str] = None) -> str:
+        digest = hashlib.sha1(f"{jinja2.__version__}|{name}|{filename or ''}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        storage_key = f"{self.KEY_PREFIX}{bucket.key}"
+        try:
+            if not self.storage.exist(storage_key):
+                return
+            data = self.storage.get(storage_key)
+        except Exception:
+            return
+        if data:
+            bucket.bytecode_from_string(bytes(data))
+            if bucket.code is not None:
+                entry = self._update_index(storage_key, len(data))
+                if "names" in entry:
+                    names = entry["names"]
+                    self._loaded_names[bucket.key] = frozenset(names) if names is not None else None
+
+    def dump_bytecode(self, bucket: Bucket) -> None:
+        storage_key = f"{self.KEY_PREFIX}{bucket.key}"
+        data = bucket.bytecode_to_string()
+        if len(data) > self.max_total_bytes:
+            return
+        try:
+            self.storage.set(storage_key, data)
+        except Exception:
+            return
+        names = getattr(bucket, "referenced_names", self.NAMES_UNKNOWN)
+        self._update_index(storage_key, len(data), names)
+
+    def clear(self) -> None:
+        index = self._read_index()
+        for storage_key in index:
+            self._delete(storage_key)
+        self._delete(self.INDEX_KEY)
+
+    def _update_index(self, storage_key: str, size: int, names: Any = NAMES_UNKNOWN) -> Dict[str, Any]:
+        index = self._read_index()
+        entry = {"size": size, "used": time.time()}
+        if names is not self.NAMES_UNKNOWN:
+            entry["names"] = sorted(names) if names is not None else None
+        elif "names" in index.get(storage_key, {}):
+            entry["names"] = index[storage_key]["names"]
+        index[storage_key] = entry
+        total = sum(int(entry.get("size") or 0) for entry in index.values())
+        for victim in sorted(index, key=lambda key: index[key].get("used") or 0):
+            if total <= self.max_total_bytes:
+                break
+            if victim == storage_key:
+                continue
+            total -= int(index.pop(victim).get("size") or 0)
+            self._delete(victim)
+        try:
+            self.storage.set(self.INDEX_KEY, json.dumps(index).encode("utf-8"))
+        except Exception:
+            pass
+        return entry
+
+    def _read_index(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            if not self.storage.exist(self.INDEX_KEY):
+                return {}
+            index = json.loads(self.storage.get(self.INDEX_KEY))
+        except Exception:
+            return {}
+        return index if isinstance(index, dict) else {}
+
+    def _delete(self, storage_key: str) -> None:
+        try:
+            self.storage.delete(storage_key)
+        except Exception:
+            pass
+
+
+class RenderProcessPool:
+    """Lazily created, bounded process pool shared by parallel batch renders.
+
+    Workers are started with forkserver (spawn where unavailable), never fork:
+    the plugin worker is multi-threaded and a child forked while another thread
+    holds one of the cache locks would deadlock on it.
+    """
+
+    START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+    def __init__(self) -> None:
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._max_workers = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def clamp_workers(max_workers: Any) -> int:
+        cpu_count = os.cpu_count() or 1
+        try:
+            requested = int(max_workers)
+        except (TypeError, ValueError):
+            requested = min(4, cpu_count)
+        return max(1, min(requested, cpu_count))
+
+    def get(self, max_workers: int) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is not None and self._max_workers != max_workers:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context(self.START_METHOD),
+                )
+                self._max_workers = max_workers
+            return self._executor
+
+    def discard(self, executor: ProcessPoolExecutor) -> None:
+        """Drop ``executor`` after it broke; other batches' work is left alone."""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self._max_workers = 0
+        executor.shutdown(wait=False)
+
+
+def _render_records_chunk(
+    template_string: str,
+    engine_options: Dict[str, Any],
+    start: int,
+    records: List[Any],
+) -> List[Dict[str, Any]]:
+    # Runs inside a pool worker: the class-level template cache is per process,
+    # so each worker compiles the template once and reuses it for later chunks.
+    renderer = RenderCore()
+    compiled = renderer.compile_template(template_string, engine_options)
+    prune = renderer._prune_enabled(engine_options)
+    return [
+        RenderCore._render_record(
+            compiled, start + offset, record, prune, renderer._render_budget(engine_options)
+        )
+        for offset, record in enumerate(records)
+    ]
+
+
+class RenderBudgetExceeded(RuntimeError):
+    """Raised when a sandboxed render exceeds its time, loop or operation budget."""
+
+
+class RenderBudget:
+    """Per-render limits enforced by BudgetedSandboxedEnvironment."""
+
+    DEFAULT_MAX_SECONDS = 10.0
+    DEFAULT_MAX_LOOP_ITERATIONS = 100_000
+    DEFAULT_MAX_OPERATIONS = 1_000_000
+    DEFAULT_MAX_RANGE = 10_000
+    # Checking the clock on every operation is measurable; every 64th is enough.
+    CLOCK_CHECK_INTERVAL = 64
+
+    __slots__ = (
+        "max_seconds",
+        "max_loop_iterations",
+        "max_operations",
+        "max_range",
+        "deadline",
+        "loop_iterations",
+        "operations",
+    )
+
+    def __init__(
+        self,
+        *,
+        max_seconds: float = DEFAULT_MAX_SECONDS,
+        max_loop_iterations: int = DEFAULT_MAX_LOOP_ITERATIONS,
+        max_operations: int = DEFAULT_MAX_OPERATIONS,
+        max_range: int = DEFAULT_MAX_RANGE,
+    ) -> None:
+        self.max_seconds = max_seconds
+        self.max_loop_iterations = max_loop_iterations
+        self.max_operations = max_operations
+        self.max_range = max_range
+        self.deadline = time.monotonic() + max_seconds
+        self.loop_iterations = 0
+        self.operations = 0
+
+    def tick(self) -> None:
+        self.operations += 1
+        if self.operations > self.max_operations:
+            raise RenderBudgetExceeded(
+                f"template exceeded the operation budget of {self.max_operations}."
+            )
+        if self.operations % self.CLOCK_CHECK_INTERVAL == 0:
+            self.check_deadline()
+
+    def check_deadline(self) -> None:
+        if time.monotonic() > self.deadline:
+            raise RenderBudgetExceeded(
+                f"template exceeded the render time limit of {self.max_seconds:g}s."
+            )
+
+    def iterate(self, iterable: Any) -> Iterator[Any]:
+        for item in iterable:
+            self.loop_iterations += 1
+            if self.loop_iterations > self.max_loop_iterations:
+                raise RenderBudgetExceeded(
+                    f"template exceeded the loop iteration budget of {self.max_loop_iterations}."
+                )
+            self.tick()
+            yield item
+
+    async def iterate_async(self, iterable: Any) -> Any:
+        async for item in iterable:
+            self.loop_iterations += 1
+            if self.loop_iterations > self.max_loop_iterations:
+                raise RenderBudgetExceeded(
+                    f"template exceeded the loop iteration budget of {self.max_loop_iterations}."
+                )
+            self.tick()
+            yield item
+
+
+_ACTIVE_RENDER_BUDGET: ContextVar[Optional[RenderBudget]] = ContextVar(
+    "docfactory_render_budget", default=None
+)
+_LOOP_GUARD_NAME = "_docfactory_loop_guard"
+
+
+def _loop_guard(iterable: Any) -> Any:
+    budget = _ACTIVE_RENDER_BUDGET.get()
+    if budget is None:
+        return iterable
+    if hasattr(iterable, "__aiter__"):
+        return budget.iterate_async(iterable)
+    return budget.iterate(iterable)
+
+
+def _budgeted_range(*args: int) -> range:
+    numbers = range(*args)
+    budget = _ACTIVE_RENDER_BUDGET.get()
+    limit = budget.max_range if budget is not None else RenderBudget.DEFAULT_MAX_RANGE
+    if len(numbers) > limit:
+        raise RenderBudgetExceeded(f"range() of {len(numbers)} items exceeds max_range {limit}.")
+    return numbers
+
+
+class RegistryScopeMixin:
+    """Scope loaded template names to the active storage in pooled environments.
+
+    Pooled environments are shared by every tenant, and Jinja2 caches loaded
+    templates by name; prefixing the name with the storage scope keeps one
+    tenant's ``{% include "macros" %}`` from resolving to another tenant's.
+    """
+
+    def _load_template(self, name: str, globals: Any) -> Template:
+        storage = _ACTIVE_TEMPLATE_STORAGE.get()
+        if storage is not None and ":" not in name:
+            name = f"{TemplateRegistry.storage_scope(storage)}:{name}"
+        return super()._load_template(name, globals)  # type: ignore[misc]
+
+
+class RegistryEnvironment(RegistryScopeMixin, Environment):
+    """Environment whose registry-loaded templates are cached per storage scope."""
+
+
+class BudgetedSandboxedEnvironment(RegistryScopeMixin, SandboxedEnvironment):
+    """SandboxedEnvironment that charges calls, lookups and loop steps to a RenderBudget.
+
+    Every ``{% for %}`` iterable is wrapped in a guard at parse time, so loops
+    count against the budget even when their body performs no calls.
+    """
+
+    intercepted_binops = frozenset(["*", "**", "+"])
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.globals["range"] = _budgeted_range
+        self.globals[_LOOP_GUARD_NAME] = _loop_guard
+
+    def _parse(self, source: str, name: Optional[str], filename: Optional[str]) -> nodes.Template:
+        ast = super()._parse(source, name, filename)
+        for loop in ast.find_all(nodes.For):
+            guard = nodes.Call(
+                nodes.Name(_LOOP_GUARD_NAME, "load", lineno=loop.lineno),
+                [loop.iter],
+                [],
+                None,
+                None,
+                lineno=loop.lineno,
+            )
+            guard.set_environment(self)
+            loop.iter = guard
+        return ast
+
+    @staticmethod
+    def _charge() -> None:
+        budget = _ACTIVE_RENDER_BUDGET.get()
+        if budget is not None:
+            budget.tick()
+
+    def call(__self, __context: Context, __obj: Any, *args: Any, **kwargs: Any) -> Any:  # noqa: N805
+        __self._charge()
+        return super().call(__context, __obj, *args, **kwargs)
+
+    def getattr(self, obj: Any, attribute: str) -> Any:
+        self._charge()
+        return super().getattr(obj, attribute)
+
+    def getitem(self, obj: Any, argument: Any) -> Any:
+        self._charge()
+        return super().getitem(obj, argument)
+
+    def call_binop(self, context: Context, operator: str, left: Any, right: Any) -> Any:
+        self._charge()
+        if operator in ("*", "**"):
+            self._check_repeat_size(operator, left, right)
+        return super().call_binop(context, operator, left, right)
+
+    @staticmethod
+    def _check_repeat_size(operator: str, left: Any, right: Any) -> None:
+        budget = _ACTIVE_RENDER_BUDGET.get()
+        limit = budget.max_range if budget is not None else RenderBudget.DEFAULT_MAX_RANGE
+        if operator == "**" and isinstance(right, int) and abs(right) > 1024:
+            raise RenderBudgetExceeded(f"exponent {right} is too large for a sandboxed render.")
+        if operator == "*":
+            for sequence, count in ((left, right), (right, left)):
+                if (
+                    isinstance(sequence, (str, list, tuple))
+                    and isinstance(count, int)
+                    and len(sequence) * count > limit * 100
+                ):
+                    raise RenderBudgetExceeded(
+                        "sequence repetition is too large for a sandboxed render."
+                    )
+
+
 class RenderCore:
     """Pure Jinja2 rendering utilities."""
 
-    def __init__(self, engine_options: Optional[Dict[str, Any]] = None) -> None:
-        self.engine_options = engine_options or {}
+    DEFAULT_ENGINE_OPTIONS: Dict[str, bool] = {
+        "autoescape": False,
+        "strict_variables": False,
+        "trim_blocks": True,
+        "lstrip_blocks": True,
+        "sandbox": False,
+    }
+
+    # Shared by every RenderCore in the worker process: repeat renders of the
+    # same template body with the same options skip lexing/parsing/compiling.
+    template_cache = TemplateCache(max_size=256)
+    environment_pool = EnvironmentPool()
+    process_pool = RenderProcessPool()
+
+    DEFAULT_PARALLEL_CHUNK_SIZE = 200
+
+    # stdlib by default: it decodes integers of any size exactly, while orjson
+    # reads integers wider than 64 bits as floats. Opt in to orjson with
+    # select_json_decoder("orjson") when inputs never carry such integers.
+    json_decoder: Callable[[Any], Any] = json.loads
+
+    def __init__(
+        self,
+        engine_options: Optional[Dict[str, Any]] = None,
+        *,
+        storage: Any = None,
+    ) -> None:
+        self.engine_options = engine_options or {}
+        self.storage = storage
+        self.bytecode_cache = PluginStorageBytecodeCache(storage) if storage is not None else None
+        # Per-render diagnostics (e.g. context pruning) surfaced by the tools.
+        self.stats: Dict[str, Any] = {}
+
+    @staticmethod
+    def coerce_json(
+        value: Any,
+        *,
+        field_name: str,
+        required: bool,
+        default: Any = None,
+    ) -> Optional[Any]:
+        if value is None:
+            if required:
+                raise ValueError(f"{field_name} is required.")
+            return default
+
+        if isinstance(value, (dict, list)):
+            return value
+
+        if isinstance(value, (str, bytes, bytearray, memoryview)):
+            # Emptiness is checked without strip(): both decoders skip
+            # surrounding whitespace, so large payloads are never copied here.
+            if isinstance(value, memoryview):
+                blank = _BLANK_BYTES.match(value) is not None
+            else:
+                blank = not value or value.isspace()
+            if blank:
+                if required:
+                    raise ValueError(f"{field_name} cannot be empty.")
+                return default
+            try:
+                return RenderCore.decode_json(value)
+            except ValueError as exc:
+                raise ValueError(f"{field_name} is not valid JSON: {exc}") from exc
+
+        raise ValueError(f"{field_name} must be a JSON string or structured object.")
+
+    @classmethod
+    def decode_json(cls, value: Any) -> Any:
+        """Decode str/bytes JSON with the selected decoder, falling back to stdlib."""
+        decoder = cls.json_decoder
+        if decoder is json.loads:
+            return json.loads(bytes(value) if isinstance(value, memoryview) else value)
+        try:
+            return decoder(value)
+        except ValueError:
+            # orjson rejects some inputs stdlib accepts (NaN, Infinity).
+            return json.loads(bytes(value) if isinstance(value, memoryview) else value)
+
+    @classmethod
+    def select_json_decoder(cls, decoder: Any) -> None:
+        """Select a decoder by name (``"json"``, ``"orjson"``) or pass a callable."""
+        if callable(decoder):
+            cls.json_decoder = decoder
+            return
+        if decoder not in JSON_DECODERS:
+            raise ValueError(
+                f"Unknown JSON decoder {decoder!r}; available: {', '.join(sorted(JSON_DECODERS))}."
+            )
+        cls.json_decoder = JSON_DECODERS[decoder]
+
+    def render(
+        self,
+        template_string: str,
+        data_context: Any,
+        engine_options: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        compiled = self.compile_template(template_string, engine_options)
+        context = self._prepare_context(compiled, data_context, engine_options)
+        budget = self._render_budget(engine_options)
+        max_chars = self._max_output_chars(engine_options)
+        started = time.perf_counter()
+        try:
+            with self._template_storage():
+                if max_chars is None and budget is None:
+                    return compiled.template.render(context)
+                fragments: Iterator[str] = compiled.template.generate(context)
+                if budget is not None:
+                    fragments = self._run_with_budget(fragments, budget)
+                if max_chars is not None:
+                    fragments = self._limit_output(fragments, max_chars)
+                return "".join(fragments)
+        finally:
+            self.stats["timings"]["render_ms"] = _elapsed_ms(started)
+
+    async def render_async(
+        self,
+        template_string: str,
+        data_context: Any,
+        engine_options: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """Render with an ``enable_async`` environment (awaitable values in the context)."""
+        compiled = self.compile_template(template_string, engine_options, enable_async=True)
+        context = self._prepare_context(compiled, data_context, engine_options)
+        budget = self._render_budget(engine_options)
+        # render_async runs in this task, so the budget set here stays active throughout.
+        token = _ACTIVE_RENDER_BUDGET.set(budget) if budget is not None else None
+        try:
+            with self._template_storage():
+                return await compiled.template.render_async(context)
+        finally:
+            if token is not None:
+                _ACTIVE_RENDER_BUDGET.reset(token)
+
+    def render_batch(
+        self,
+        template_string: str,
+        records: List[Any],
+        engine_options: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Render one template against many records, compiling it only once.
+
+        With ``{"parallel": true}`` in the engine options the records are sent
+        in chunks (``chunk_size``) to a process pool of ``max_workers`` workers;
+        results always come back in input order.
+        """
+        options = engine_options or {}
+        compiled = self.compile_template(template_string, options)
+        prune = self._prune_enabled(options)
+        if prune:
+            self._record_batch_context_stats(compiled, records)
+        if options.get("parallel"):
+            chunk_size = _positive_int_or(options.get("chunk_size"), self.DEFAULT_PARALLEL_CHUNK_SIZE)
+            # Pool workers have no plugin storage, so templates that include
+            # registered templates are always rendered in-process.
+            if len(records) > chunk_size and compiled.referenced_names is not None:
+                parallel = self._render_batch_parallel(
+                    template_string, records, options, chunk_size
+                )
+                if parallel is not None:
+                    return parallel
+        with self._template_storage():
+            return [
+                self._render_record(compiled, index, record, prune, self._render_budget(options))
+                for index, record in enumerate(records)
+            ]
+
+    def _render_batch_parallel(
+        self,
+        template_string: str,
+        records: List[Any],
+        engine_options: Dict[str, Any],
+        chunk_size: int,
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Render in the process pool; None means fall back to rendering in-process."""
+        env_options = dict(self.engine_options)
+        env_options.update(engine_options)
+        max_workers = self.process_pool.clamp_workers(engine_options.get("max_workers"))
+        executor = self.process_pool.get(max_workers)
+        starts = range(0, len(records), chunk_size)
+        results: List[Dict[str, Any]] = []
+        try:
+            chunks = executor.map(
+                _render_records_chunk,
+                [template_string] * len(starts),
+                [env_options] * len(starts),
+                starts,
+                [records[start : start + chunk_size] for start in starts],
+            )
+            for chunk in chunks:
+                results.extend(chunk)
+        except (BrokenProcessPool, OSError):
+            self.process_pool.discard(executor)
+            return None
+        except CancelledError:
+            # Another batch replaced the pool (different max_workers) meanwhile.
+            return None
+        except RuntimeError as exc:
+            if "after shutdown" not in str(exc):
+                raise
+            return None
+        return results
+
+    def _record_batch_context_stats(
+        self, compiled: CompiledTemplate, records: List[Any]
+    ) -> None:
+        totals: Optional[Dict[str, int]] = None
+        for record in records:
+            record_stats = compiled.context_stats(record)
+            if record_stats is None:
+                continue
+            if totals is None:
+                totals = dict.fromkeys(record_stats, 0)
+            for key, value in record_stats.items():
+                totals[key] += value
+        if totals is not None:
+            self.stats["context"] = totals
+
+    @staticmethod
+    def _render_record(
+        compiled: CompiledTemplate,
+        index: int,
+        record: Any,
+        prune: bool = True,
+        budget: Optional[RenderBudget] = None,
+    ) -> Dict[str, Any]:
+        """Render one batch record; a sandbox ``budget`` (fresh per record) limits it."""
+        if isinstance(record, dict):
+            context = compiled.select_context(record) if prune else record
+        else:
+            context = {"record": record}
+        token = _ACTIVE_RENDER_BUDGET.set(budget) if budget is not None else None
+        try:
+            return {"index": index, "rendered_text": compiled.template.render(context), "error": None}
+        except RenderBudgetExceeded as exc:
+            return {"index": index, "rendered_text": "", "error": f"Template sandbox limit exceeded: {exc}"}
+        except Exception as exc:
+            return {"index": index, "rendered_text": "", "error": f"Template rendering failed: {exc}"}
+        finally:
+            if token is not None:
+                _ACTIVE_RENDER_BUDGET.reset(token)
 
     @staticmethod
-    def coerce_json(
+    def extract_records(
         value: Any,
         *,
         field_name: str,
-        required: bool,
-        default: Any = None,
-    ) -> Optional[Any]:
-        if value is None:
-            if required:
-                raise ValueError(f"{field_name} is required.")
-            return default
-
-        if isinstance(value, (dict, list)):
+        records_key: Optional[str] = None,
+    ) -> List[Any]:
+        """Return the record list from a JSON array or an object holding one."""
+        if isinstance(value, list):
             return value
+        if not isinstance(value, dict):
+            raise ValueError(f"{field_name} must be a JSON array or an object holding an array.")
+
+        if records_key:
+            candidate = value.get(records_key)
+            if not isinstance(candidate, list):
+                raise ValueError(f"{field_name}.{records_key} must be a JSON array.")
+            return candidate
+
+        for key in ("records", "items", "data", "rows"):
+            if isinstance(value.get(key), list):
+                return value[key]
+        arrays = [item for item in value.values() if isinstance(item, list)]
+        if len(arrays) == 1:
+            return arrays[0]
+        raise ValueError(
+            f"{field_name} must hold exactly one array; use records_key to pick one."
+        )
 
-        if isinstance(value, str):
-            value = value.strip()
-            if not value:
-                if required:
-                    raise ValueError(f"{field_name} cannot be empty.")
-                return default
+    def render_stream(
+        self,
+        template_string: str,
+        data_context: Any,
+        engine_options: Optional[Dict[str, Any]] = None,
+        *,
+        chunk_size: int = 4000,
+    ) -> Iterator[str]:
+        """Render through ``Template.generate`` yielding chunks of ~chunk_size chars."""
+        compiled = self.compile_template(template_string, engine_options)
+        context = self._prepare_context(compiled, data_context, engine_options)
+        fragments: Iterator[str] = compiled.template.generate(context)
+        if self.storage is not None:
+            fragments = self._bind_template_storage(fragments, self.storage)
+        budget = self._render_budget(engine_options)
+        if budget is not None:
+            fragments = self._run_with_budget(fragments, budget)
+        max_chars = self._max_output_chars(engine_options)
+        if max_chars is not None:
+            fragments = self._limit_output(fragments, max_chars)
+        if self._execution_option(engine_options, "timings", False):
+            fragments = self._time_fragments(fragments, self.stats["timings"])
+        return self._iter_chunks(fragments, max(1, int(chunk_size)))
+
+    @staticmethod
+    def _time_fragments(fragments: Iterator[str], timings: Dict[str, Any]) -> Iterator[str]:
+        """Accumulate the time spent producing fragments, not the consumer's time."""
+        timings["render_ms"] = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    fragment = next(fragments)
+                except StopIteration:
+                    return
+                finally:
+                    timings["render_ms"] = round(timings["render_ms"] + _elapsed_ms(started), 3)
+                yield fragment
+        finally:
+            close = getattr(fragments, "close", None)
+            if close is not None:
+                close()
+
+    def _render_budget(self, engine_options: Optional[Dict[str, Any]]) -> Optional[RenderBudget]:
+        if not self._execution_option(engine_options, "sandbox", False):
+            return None
+
+        def option(key: str, default: Any) -> Any:
+            value = self._execution_option(engine_options, key, None)
             try:
-                return json.loads(value)
-            except json.JSONDecodeError as exc:
-                raise ValueError(f"{field_name} is not valid JSON: {exc}") from exc
+                number = type(default)(value)
+            except (TypeError, ValueError):
+                return default
+            return number if number > 0 else default
+
+        return RenderBudget(
+            max_seconds=option("max_render_seconds", RenderBudget.DEFAULT_MAX_SECONDS),
+            max_loop_iterations=option(
+                "max_loop_iterations", RenderBudget.DEFAULT_MAX_LOOP_ITERATIONS
+            ),
+            max_operations=option("max_operations", RenderBudget.DEFAULT_MAX_OPERATIONS),
+            max_range=option("max_range", RenderBudget.DEFAULT_MAX_RANGE),
+        )
 
-        raise ValueError(f"{field_name} must be a JSON string or structured object.")
+    @staticmethod
+    def _run_with_budget(fragments: Iterator[str], budget: RenderBudget) -> Iterator[str]:
+        """Make ``budget`` active while each fragment is produced (also when streaming)."""
+        try:
+            while True:
+                token = _ACTIVE_RENDER_BUDGET.set(budget)
+                try:
+                    fragment = next(fragments)
+                except StopIteration:
+                    return
+                finally:
+                    _ACTIVE_RENDER_BUDGET.reset(token)
+                budget.check_deadline()
+                yield fragment
+        finally:
+            close = getattr(fragments, "close", None)
+            if close is not None:
+                close()
+
+    @contextmanager
+    def _template_storage(self) -> Iterator[None]:
+        """Expose this renderer's storage to the registry loader during a render."""
+        if self.storage is None:
+            yield
+            return
+        token = _ACTIVE_TEMPLATE_STORAGE.set(self.storage)
+        try:
+            yield
+        finally:
+            _ACTIVE_TEMPLATE_STORAGE.reset(token)
 
-    def render(
+    @staticmethod
+    def _bind_template_storage(fragments: Iterator[str], storage: Any) -> Iterator[str]:
+        """Like ``_template_storage`` but for lazily consumed (streamed) fragments."""
+        try:
+            while True:
+                token = _ACTIVE_TEMPLATE_STORAGE.set(storage)
+                try:
+                    fragment = next(fragments)
+                except StopIteration:
+                    return
+                finally:
+                    _ACTIVE_TEMPLATE_STORAGE.reset(token)
+                yield fragment
+        finally:
+            close = getattr(fragments, "close", None)
+            if close is not None:
+                close()
+
+    def _max_output_chars(self, engine_options: Optional[Dict[str, Any]]) -> Optional[int]:
+        value = self._execution_option(engine_options, "max_output_chars", None)
+        if value is None:
+            return None
+        limit = _positive_int_or(value, 0)
+        return limit or None
+
+    def _limit_output(self, fragments: Iterator[str], max_chars: int) -> Iterator[str]:
+        """Pass fragments through until ``max_chars``, then stop the render early.
+
+        Closing the generator aborts ``Template.generate`` so a runaway template
+        stops consuming CPU and memory as soon as the budget is exceeded.
+        """
+        produced = 0
+        produced_bytes = 0
+        truncated = False
+        try:
+            for fragment in fragments:
+                remaining = max_chars - produced
+                if len(fragment) > remaining:
+                    fragment = fragment[:remaining]
+                    truncated = True
+                produced += len(fragment)
+                produced_bytes += len(fragment.encode("utf-8"))
+                if fragment:
+                    yield fragment
+                if truncated:
+                    break
+        finally:
+            close = getattr(fragments, "close", None)
+            if close is not None:
+                close()
+            self.stats["output"] = {
+                "truncated": truncated,
+                "max_output_chars": max_chars,
+                "output_chars": produced,
+                "output_bytes": produced_bytes,
+            }
+
+    @staticmethod
+    def _iter_chunks(fragments: Iterator[str], chunk_size: int) -> Iterator[str]:
+        buffer: List[str] = []
+        buffered = 0
+        for fragment in fragments:
+            if not fragment:
+                continue
+            buffer.append(fragment)
+            buffered += len(fragment)
+            if buffered < chunk_size:
+                continue
+            pending = "".join(buffer)
+            while len(pending) >= chunk_size:
+                yield pending[:chunk_size]
+                pending = pending[chunk_size:]
+            buffer = [pending] if pending else []
+            buffered = len(pending)
+        if buffer:
+            yield "".join(buffer)
+
+    def get_template(
         self,
         template_string: str,
-        data_context: Any,
         engine_options: Optional[Dict[str, Any]] = None,
-    ) -> str:
-        env = self._build_environment(engine_options or {})
-        template = env.from_string(template_string)
-        return template.render(data_context)
-
-    def _build_environment(self, overrides: Dict[str, Any]) -> Environment:
-        options = {
-            "autoescape": False,
-            "strict_variables": False,
-            "trim_blocks": True,
-            "lstrip_blocks": True,
-        }
-        options.update(self.engine_options)
-        options.update(overrides)
+    ) -> Template:
+        return self.compile_template(template_string, engine_options).template
+
+    def compile_template(
+        self,
+        template_string: str,
+        engine_options: Optional[Dict[str, Any]] = None,
+        *,
+        enable_async: bool = False,
+    ) -> CompiledTemplate:
+        options = self._normalize_options(engine_options or {})
+        if enable_async:
+            options["enable_async"] = True
+        cache_key = self._template_cache_key(template_string, options)
+        compiled = self.template_cache.get(cache_key)
+        timings: Dict[str, Any] = {"cache": "hit" if compiled is not None else "miss"}
+        if compiled is None:
+            env = self.get_environment(options)
+            compiled = self._compile_template(env, template_string, cache_key, timings)
+            self.template_cache.put(cache_key, compiled)
+        self.stats["timings"] = timings
+        return compiled
+
+    def _compile_template(
+        self,
+        env: Environment,
+        template_string: str,
+        cache_key: str,
+        timings: Optional[Dict[str, Any]] = None,
+    ) -> CompiledTemplate:
+        timings = timings if timings is not None else {}
+        bytecode_cache = self.bytecode_cache
+        bucket = None
+        names: Any = PluginStorageBytecodeCache.NAMES_UNKNOWN
+        lookup_started = time.perf_counter()
+        if bytecode_cache is not None:
+            # Look up bytecode first: a hit with stored names skips the parse entirely.
+            bucket = bytecode_cache.get_bucket(env, cache_key, None, template_string)
+            timings["bytecode_cache"] = "miss" if bucket.code is None else "hit"
+            if bucket.code is not None:
+                names = bytecode_cache.referenced_names(bucket)
+        lookup_ms = _elapsed_ms(lookup_started)
+
+        ast = None
+        if bucket is None or bucket.code is None or names is PluginStorageBytecodeCache.NAMES_UNKNOWN:
+            started = time.perf_counter()
+            # Parsing once serves both the static analysis and the code generator.
+            ast = env.parse(template_string)
+            timings["parse_ms"] = _elapsed_ms(started)
+            names = CompiledTemplate.names_from_ast(ast)
+
+        started = time.perf_counter()
+        if bucket is None:
+            code = env.compile(ast)
+        else:
+            if bucket.code is None or ast is not None:
+                if bucket.code is None:
+                    bucket.code = env.compile(ast)
+                bucket.referenced_names = names
+                bytecode_cache.set_bucket(bucket)
+            code = bucket.code
+        template = env.template_class.from_code(env, code, env.make_globals(None))
+        # Bytecode lookup counts as compile time, as it replaces compiling.
+        timings["compile_ms"] = round(lookup_ms + _elapsed_ms(started), 3)
+        return CompiledTemplate(template, names)
+
+    def _prepare_context(
+        self,
+        compiled: CompiledTemplate,
+        data_context: Any,
+        engine_options: Optional[Dict[str, Any]],
+    ) -> Any:
+        if not self._prune_enabled(engine_options):
+            return data_context
+        context_stats = compiled.context_stats(data_context)
+        if context_stats is not None:
+            self.stats["context"] = context_stats
+        return compiled.select_context(data_context)
+
+    def _prune_enabled(self, engine_options: Optional[Dict[str, Any]]) -> bool:
+        return bool(self._execution_option(engine_options, "prune_context", True))
+
+    def _execution_option(
+        self,
+        engine_options: Optional[Dict[str, Any]],
+        key: str,
+        default: Any,
+    ) -> Any:
+        if engine_options and key in engine_options:
+            return engine_options[key]
+        return self.engine_options.get(key, default)
+
+    def get_environment(self, options: Dict[str, bool]) -> Environment:
+        return self.environment_pool.get(options, self._build_environment)
+
+    def _normalize_options(self, overrides: Dict[str, Any]) -> Dict[str, bool]:
+        merged: Dict[str, Any] = dict(self.DEFAULT_ENGINE_OPTIONS)
+        merged.update(self.engine_options)
+        merged.update(overrides)
+        return {key: bool(merged.get(key)) for key in self.DEFAULT_ENGINE_OPTIONS}
+
+    @staticmethod
+    def _template_cache_key(template_string: str, options: Dict[str, bool]) -> str:
+        digest = hashlib.sha256(template_string.encode("utf-8"))
+        digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
 
+    def _build_environment(self, options: Dict[str, bool]) -> Environment:
         undefined_cls = StrictUndefined if options.get("strict_variables") else Undefined
-        env = Environment(
-            loader=BaseLoader(),
-            autoescape=bool(options.get("autoescape", False)),
+        env_cls = BudgetedSandboxedEnvironment if options.get("sandbox") else RegistryEnvironment
+        env = env_cls(
+            loader=REGISTRY_LOADER,
+            autoescape=options.get("autoescape", False),
             undefined=undefined_cls,
             trim_blocks=options.get("trim_blocks", True),
             lstrip_blocks=options.get("lstrip_blocks", True),
+            enable_async=options.get("enable_async", False),
         )
         env.filters["format_currency"] = self._format_currency
         env.filters["format_date"] = self._format_date
+        env.filters["format_currency_all"] = self._format_currency_all
+        env.filters["format_date_all"] = self._format_date_all
+        env.filters["sum_by"] = self._sum_by
+        env.filters["index_by"] = self._index_by
+        env.filters["lookup"] = self._lookup
+        env.filters["group_sum"] = self._group_sum
         return env
 
     @staticmethod
-    def _format_currency(value: Any, currency: str = "EUR", decimals: int = 2) -> str:
-        if value is None or value == "":
-            return ""
-        try:
-            amount = Decimal(str(value))
-        except (InvalidOperation, ValueError):
-            return str(value)
-
-        quantized = amount.quantize(Decimal(10) ** -decimals)
-        formatted = f"{quantized:,.{decimals}f}"
-        formatted = formatted.replace(",", "X").replace(".", ",").replace("X", ".")
-        return f"{formatted} {currency}".strip()
+    def _format_currency(
+        value: Any,
+        currency: str = "EUR",
+        decimals: int = 2,
+        style: str = "eu",
+    ) -> str:
+        return get_currency_formatter(currency, decimals, style).format(value)
 
     @staticmethod
     def _format_date(value: Any, fmt: str = "%d/%m/%Y") -> str:
@@ -177,22 +2068,560 @@ class RenderCore:
             value = value.strip()
             if not value:
                 return ""
-            for date_format in ("%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", "%d/%m/%Y"):
-                try:
-                    dt = datetime.strptime(value, date_format)
-                    break
-                except ValueError:
-                    continue
+            dt = parse_date_string(value)
             if dt is None:
-                try:
-                    dt = datetime.fromisoformat(value)
-                except ValueError:
-                    return value
+                return value
         else:
             return str(value)
 
         return dt.strftime(fmt) if dt else ""
 
+    @staticmethod
+    def _format_currency_all(
+        values: Iterable[Any],
+        currency: str = "EUR",
+        decimals: int = 2,
+        style: str = "eu",
+        attribute: Optional[str] = None,
+    ) -> List[str]:
+        format_value = get_currency_formatter(currency, decimals, style).format
+        if attribute:
+            getter = _field_getter(attribute)
+            return [format_value(getter(item)) for item in values]
+        return [format_value(value) for value in values]
+
+    @staticmethod
+    def _format_date_all(
+        values: Iterable[Any],
+        fmt: str = "%d/%m/%Y",
+        attribute: Optional[str] = None,
+    ) -> List[str]:
+        format_value = RenderCore._format_date
+        if attribute:
+            getter = _field_getter(attribute)
+            return [format_value(getter(item), fmt) for item in values]
+        return [format_value(value, fmt) for value in values]
+
+    @staticmethod
+    def _sum_by(items: Iterable[Any], attribute: Optional[str] = None) -> Decimal:
+        getter = _field_getter(attribute) if attribute else None
+        total = Decimal(0)
+        for item in items:
+            amount = _to_decimal(getter(item) if getter else item)
+            if amount is not None:
+                total += amount
+        return total
+
+    @staticmethod
+    @pass_context
+    def _index_by(
+        context: Context,
+        items: Iterable[Any],
+        attribute: str,
+        multiple: bool = False,
+    ) -> Dict[Any, Any]:
+        """Build a hash index once per render; repeat calls on the same list reuse it."""
+        if not isinstance(items, (list, tuple)):
+            return RenderCore._build_index(items, attribute, multiple)
+
+        memo: Optional[Dict[tuple, tuple]] = getattr(context, "_docfactory_index_memo", None)
+        if memo is None:
+            memo = {}
+            context._docfactory_index_memo = memo  # type: ignore[attr-defined]
+        memo_key = (id(items), attribute, bool(multiple))
+        cached = memo.get(memo_key)
+        # The source list is kept in the memo so its id() cannot be reused mid-render.
+        if cached is not None and cached[0] is items:
+            return cached[1]
+        index = RenderCore._build_index(items, attribute, multiple)
+        memo[memo_key] = (items, index)
+        return index
+
+    @staticmethod
+    def _lookup(index: Any, key: Any, default: Any = None) -> Any:
+        if isinstance(index, dict):
+            return index.get(key, default)
+        return default
+
+    @staticmethod
+    def _build_index(
+        items: Iterable[Any],
+        attribute: str,
+        multiple: bool,
+    ) -> Dict[Any, Any]:
+        getter = _field_getter(attribute)
+        index: Dict[Any, Any] = {}
+        if multiple:
+            for item in items:
+                index.setdefault(getter(item), []).append(item)
+        else:
+            for item in items:
+                index[getter(item)] = item
+        return index
+
+    @staticmethod
+    def _group_sum(
+        items: Iterable[Any],
+        key_attribute: str,
+        value_attribute: str,
+    ) -> Dict[Any, Decimal]:
+        key_getter = _field_getter(key_attribute)
+        value_getter = _field_getter(value_attribute)
+        groups: Dict[Any, Decimal] = {}
+        for item in items:
+            key = key_getter(item)
+            amount = _to_decimal(value_getter(item))
+            groups[key] = groups.get(key, Decimal(0)) + (amount if amount is not None else 0)
+        return groups
+
+
+class TemplateRegistryError(ValueError):
+    """Raised for invalid template registry operations or unknown templates."""
+
+
+class TemplateRegistry:
+    """Versioned named templates stored in the Dify plugin storage.
+
+    Layout: one JSON index (``INDEX_KEY``) with per-template version metadata
+    and one storage entry per ``template_id@version`` body. Versions are
+    immutable, so bodies are also kept in a per-process cache; the index
+    (itself cached for ``INDEX_TTL_SECONDS``) is still checked on every
+    lookup so versions removed by another worker stop resolving.
+
+    Plugin storage is per tenant while the caches are per worker process, so
+    every cache entry is keyed by the storage's scope: a random id kept in
+    the storage itself (``SCOPE_KEY``), see ``storage_scope``.
+    """
+
+    INDEX_KEY = "docfactory_tpl_index"
+    SCOPE_KEY = "docfactory_tpl_scope"
+    BODY_KEY_PREFIX = "docfactory_tpl_"
+    # Bytecode uses half of the 1 MiB quota in manifest.yaml; templates get the rest
+    # minus headroom for the index itself.
+    MAX_TOTAL_BYTES = 448 * 1024
+    TEMPLATE_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+    # Unpinned lookups and loader uptodate checks reuse the index for this long
+    # instead of reading it from storage on every render.
+    INDEX_TTL_SECONDS = 2.0
+
+    BODY_CACHE_SIZE = 256
+
+    # Keyed by (scope, reference) / scope; see storage_scope().
+    _body_cache: "OrderedDict[tuple, str]" = OrderedDict()
+    _index_snapshots: Dict[str, tuple] = {}
+    _warmed_scopes: set = set()
+    _scopes: "weakref.WeakKeyDictionary[Any, str]" = weakref.WeakKeyDictionary()
+    _cache_lock = threading.Lock()
+    # Serializes registers within the worker; across workers the body-key
+    # existence check in register() keeps concurrent writers apart.
+    _register_lock = threading.Lock()
+
+    def __init__(self, storage: Any) -> None:
+        if storage is None:
+            raise TemplateRegistryError("The template registry requires plugin storage.")
+        self.storage = storage
+        self._index: Optional[Dict[str, Any]] = None
+        self._scope: Optional[str] = None
+
+    @classmethod
+    def storage_scope(cls, storage: Any) -> str:
+        """Stable id of one plugin storage (tenant), created on first use."""
+        try:
+            scope = cls._scopes.get(storage)
+        except TypeError:  # storage objects that cannot be weakly referenced
+            scope = None
+        if scope:
+            return scope
+        if storage.exist(cls.SCOPE_KEY):
+            scope = bytes(storage.get(cls.SCOPE_KEY)).decode("utf-8")
+        else:
+            scope = uuid4().hex
+            storage.set(cls.SCOPE_KEY, scope.encode("utf-8"))
+        try:
+            cls._scopes[storage] = scope
+        except TypeError:
+            pass
+        return scope
+
+    @property
+    def scope(self) -> str:
+        if self._scope is None:
+            self._scope = self.storage_scope(self.storage)
+        return self._scope
+
+    @classmethod
+    def parse_reference(cls, reference: str) -> tuple:
+        """Split ``template_id[@version]`` into (template_id, version or None)."""
+        text = str(reference or "").strip()
+        template_id, _, version_text = text.partition("@")
+        if not cls.TEMPLATE_ID_PATTERN.match(template_id):
+            raise TemplateRegistryError(
+                f"Invalid template_id {template_id!r}: use letters, digits, '_', '-' or '.' (max 64)."
+            )
+        if not version_text:
+            return template_id, None
+        if not version_text.isdigit() or int(version_text) < 1:
+            raise TemplateRegistryError(f"Invalid template version {version_text!r}.")
+        return template_id, int(version_text)
+
+    @classmethod
+    def resolve(
+        cls,
+        params: Dict[str, Any],
+        storage: Any,
+        engine_options: Dict[str, Any],
+    ) -> tuple:
+        """Pick the template for a render tool call: ``template_id`` or inline ``template``.
+
+        Returns (template body, engine options, registry reference or None).
+        Options given at render time override the ones stored with the version.
+        """
+        template_id = str(params.get("template_id") or "").strip()
+        if not template_id:
+            template_string = params.get("template")
+            if not isinstance(template_string, str) or not template_string.strip():
+                raise ValueError("template (or template_id) is required and must be a non-empty string.")
+            return template_string, engine_options, None
+
+        registry = cls(storage)
+        registry.warm()
+        item = registry.get(template_id)
+        return item["template"], {**item["engine_options"], **engine_options}, item["reference"]
+
+    def register(
+        self,
+        template_id: str,
+        template_string: str,
+        *,
+        engine_options: Optional[Dict[str, Any]] = None,
+        description: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        template_id, version = self.parse_reference(template_id)
+        if version is not None:
+            raise TemplateRegistryError("Versions are assigned on register; pass the bare template_id.")
+        if not isinstance(template_string, str) or not template_string.strip():
+            raise TemplateRegistryError("template is required and must be a non-empty string.")
+        options = engine_options or {}
+        # Refuse templates that do not compile; this also warms this worker's cache.
+        RenderCore().compile_template(template_string, options)
+
+        with self._register_lock:
+            index = self._load_index(fresh=True)
+            entry = index.setdefault(template_id, {"latest": 0, "versions": {}})
+            digest = hashlib.sha256(template_string.encode("utf-8")).hexdigest()
+            latest = entry["versions"].get(str(entry["latest"]))
+            if latest and latest.get("sha256") == digest and latest.get("engine_options") == options:
+                return self._describe(template_id, entry["latest"], latest)
+
+            size = len(template_string.encode("utf-8"))
+            used = sum(
+                int(meta.get("size") or 0)
+                for item in index.values()
+                for meta in item.get("versions", {}).values()
+            )
+            if used + size > self.MAX_TOTAL_BYTES:
+                raise TemplateRegistryError(
+                    f"Template registry storage budget exceeded ({used + size} > {self.MAX_TOTAL_BYTES} bytes)."
+                )
+
+            # Numbers of deleted versions are never reused: pinned references and
+            # loader caches must not silently switch to a different body.
+            version = max(int(entry["latest"]), int(entry.get("last_version") or 0)) + 1
+            # Plugin storage has no compare-and-set, so a concurrent register may
+            # already hold this number; bodies are immutable, take the next free one.
+            while self.storage.exist(f"{self.BODY_KEY_PREFIX}{template_id}@{version}"):
+                version += 1
+            reference = f"{template_id}@{version}"
+            self.storage.set(f"{self.BODY_KEY_PREFIX}{reference}", template_string.encode("utf-8"))
+            meta_entry = {
+                "sha256": digest,
+                "size": size,
+                "engine_options": options,
+                "description": description or "",
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            }
+            # Re-read the index just before writing it so versions registered
+            # concurrently since the first read are kept.
+            index = self._load_index(fresh=True)
+            entry = index.setdefault(template_id, {"latest": 0, "versions": {}})
+            entry["versions"][str(version)] = meta_entry
+            entry["latest"] = max(int(entry["latest"]), version)
+            entry["last_version"] = max(int(entry.get("last_version") or 0), version)
+            self._save_index(index)
+        self._cache_body(reference, template_string)
+        return self._describe(template_id, version, meta_entry)
+
+    def get(self, reference: str) -> Dict[str, Any]:
+        """Return the template body, engine options and metadata for a reference."""
+        template_id, version = self.parse_reference(reference)
+        # Pinned references check the index too: a cached body may belong to a
+        # version another worker has deleted or pruned since.
+        entry = self._load_index().get(template_id)
+        if not entry or not entry.get("versions"):
+            raise TemplateRegistryError(f"Template {template_id!r} is not registered.")
+        version = version or int(entry["latest"])
+        meta_entry = entry["versions"].get(str(version))
+        if meta_entry is None:
+            raise TemplateRegistryError(f"Template {template_id!r} has no version {version}.")
+
+        key = f"{template_id}@{version}"
+        body = self._cached_body(key)
+        if body is None:
+            body = bytes(self.storage.get(f"{self.BODY_KEY_PREFIX}{key}")).decode("utf-8")
+            self._cache_body(key, body)
+        described = self._describe(template_id, version, meta_entry)
+        described["template"] = body
+        return described
+
+    def list_templates(self) -> List[Dict[str, Any]]:
+        summaries = []
+        for template_id, entry in sorted(self._load_index().items()):
+            if not entry.get("versions"):
+                continue
+            latest = int(entry.get("latest") or 0)
+            meta_entry = entry.get("versions", {}).get(str(latest), {})
+            summary = self._describe(template_id, latest, meta_entry)
+            summary["version_count"] = len(entry.get("versions", {}))
+            summaries.append(summary)
+        return summaries
+
+    def latest_version(self, template_id: str) -> Optional[int]:
+        entry = self._load_index().get(template_id)
+        return int(entry["latest"]) if entry and entry.get("versions") else None
+
+    def has_version(self, template_id: str, version: int) -> bool:
+        entry = self._load_index().get(template_id)
+        return bool(entry) and str(version) in entry.get("versions", {})
+
+    def list_versions(self, template_id: str) -> List[Dict[str, Any]]:
+        template_id, _ = self.parse_reference(template_id)
+        entry = self._load_index().get(template_id)
+        if not entry or not entry.get("versions"):
+            raise TemplateRegistryError(f"Template {template_id!r} is not registered.")
+        return [
+            self._describe(template_id, int(version), meta_entry)
+            for version, meta_entry in sorted(
+                entry.get("versions", {}).items(), key=lambda item: int(item[0])
+            )
+        ]
+
+    def delete(self, reference: str) -> List[Dict[str, Any]]:
+        """Remove one version (``template_id@version``) or every version of a template."""
+        template_id, version = self.parse_reference(reference)
+        entry = self._load_index(fresh=True).get(template_id)
+        if not entry or not entry.get("versions"):
+            raise TemplateRegistryError(f"Template {template_id!r} is not registered.")
+        if version is None:
+            versions = [int(number) for number in entry["versions"]]
+        elif str(version) in entry["versions"]:
+            versions = [version]
+        else:
+            raise TemplateRegistryError(f"Template {template_id!r} has no version {version}.")
+        return self._remove_versions(template_id, versions)
+
+    def prune(self, template_id: str, keep_versions: int = 1) -> List[Dict[str, Any]]:
+        """Remove all but the ``keep_versions`` newest versions of a template."""
+        template_id, version = self.parse_reference(template_id)
+        if version is not None:
+            raise TemplateRegistryError("prune takes the bare template_id.")
+        keep = max(1, int(keep_versions))
+        entry = self._load_index(fresh=True).get(template_id)
+        if not entry or not entry.get("versions"):
+            raise TemplateRegistryError(f"Template {template_id!r} is not registered.")
+        versions = sorted(int(number) for number in entry["versions"])
+        return self._remove_versions(template_id, versions[:-keep])
+
+    def _remove_versions(self, template_id: str, versions: List[int]) -> List[Dict[str, Any]]:
+        index = self._load_index(fresh=True)
+        entry = index[template_id]
+        removed = []
+        for version in versions:
+            meta_entry = entry["versions"].pop(str(version), None)
+            if meta_entry is None:
+                continue
+            self.storage.delete(f"{self.BODY_KEY_PREFIX}{template_id}@{version}")
+            removed.append(self._describe(template_id, version, meta_entry))
+        remaining = [int(number) for number in entry["versions"]]
+        entry["last_version"] = max(int(entry.get("last_version") or 0), int(entry["latest"]))
+        entry["latest"] = max(remaining) if remaining else 0
+        self._save_index(index)
+        scope = self.scope
+        with self._cache_lock:
+            for version in versions:
+                self._body_cache.pop((scope, f"{template_id}@{version}"), None)
+        return removed
+
+    def warm(self) -> int:
+        """Precompile every latest version once per worker process and storage."""
+        scope = self.scope
+        with self._cache_lock:
+            if scope in self._warmed_scopes:
+                return 0
+            self._warmed_scopes.add(scope)
+        compiled = 0
+        renderer = RenderCore(storage=self.storage)
+        for summary in self.list_templates():
+            try:
+                item = self.get(summary["reference"])
+                renderer.compile_template(item["template"], item["engine_options"])
+            except Exception:
+                continue
+            compiled += 1
+        return compiled
+
+    @staticmethod
+    def _describe(template_id: str, version: int, meta_entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "template_id": template_id,
+            "version": version,
+            "reference": f"{template_id}@{version}",
+            "sha256": meta_entry.get("sha256"),
+            "size": meta_entry.get("size"),
+            "engine_options": meta_entry.get("engine_options") or {},
+            "description": meta_entry.get("description") or "",
+            "created_at": meta_entry.get("created_at"),
+        }
+
+    def _load_index(self, fresh: bool = False) -> Dict[str, Any]:
+        if self._index is not None and not fresh:
+            return self._index
+        snapshot = self._index_snapshots.get(self.scope)
+        if (
+            not fresh
+            and snapshot is not None
+            and time.monotonic() - snapshot[0] < self.INDEX_TTL_SECONDS
+        ):
+            self._index = snapshot[1]
+            return snapshot[1]
+        index: Any = {}
+        if self.storage.exist(self.INDEX_KEY):
+            index = json.loads(bytes(self.storage.get(self.INDEX_KEY)).decode("utf-8"))
+        self._remember_index(index if isinstance(index, dict) else {})
+        return self._index
+
+    def _save_index(self, index: Dict[str, Any]) -> None:
+        self.storage.set(self.INDEX_KEY, json.dumps(index).encode("utf-8"))
+        self._remember_index(index)
+
+    def _remember_index(self, index: Dict[str, Any]) -> None:
+        self._index = index
+        self._index_snapshots[self.scope] = (time.monotonic(), index)
+
+    def _cached_body(self, reference: str) -> Optional[str]:
+        key = (self.scope, reference)
+        with self._cache_lock:
+            body = self._body_cache.get(key)
+            if body is not None:
+                self._body_cache.move_to_end(key)
+            return body
+
+    def _cache_body(self, reference: str, body: str) -> None:
+        key = (self.scope, reference)
+        with self._cache_lock:
+            self._body_cache[key] = body
+            while len(self._body_cache) > self.BODY_CACHE_SIZE:
+                self._body_cache.popitem(last=False)
+
+
+def plugin_storage(tool: Any) -> Any:
+    """Plugin storage of a Dify tool invocation (None outside the plugin runtime)."""
+    session = getattr(tool, "session", None)
+    return getattr(session, "storage", None)
+
+
+def kb_timings_enabled(params: Dict[str, Any]) -> bool:
+    """Whether a Knowledge Base tool call asked for the opt-in ``timings`` output."""
+    return str(params.get("timings") or "").strip().lower() in {"true", "1", "yes"}
+
+
+def build_kb_timings(core: Any, started: float) -> Dict[str, Any]:
+    """Every HTTP call of the core's operation with endpoint, status, duration and bytes, plus totals."""
+    timings: Dict[str, Any] = core.client.timing_summary(core.operation)
+    sleep_seconds = getattr(core, "sleep_seconds", None)
+    if sleep_seconds is not None:
+        timings["wait_sleep_ms"] = round(sleep_seconds * 1000, 3)
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return timings
+
+
+# Storage of the RenderCore currently rendering; read by RegistryLoader when a
+# template includes, imports or extends a registered template.
+_ACTIVE_TEMPLATE_STORAGE: ContextVar[Any] = ContextVar(
+    "docfactory_template_storage", default=None
+)
+
+
+class RegistryLoader(BaseLoader):
+    """Load ``{% include %}``/``{% import %}``/``{% extends %}`` targets from the registry.
+
+    Names are registry references: ``"macros"`` follows the latest version and
+    ``"macros@2"`` is pinned. RegistryScopeMixin prefixes them with the storage
+    scope (``"<scope>:macros"``), so loaded templates stay in each pooled
+    environment's cache per tenant: a shared macro library is compiled once per
+    worker, storage and option set. ``uptodate`` reloads an unpinned name once
+    a newer version is registered and a pinned one once it was removed.
+    """
+
+    def get_source(self, environment: Environment, template: str) -> tuple:
+        scope, _, reference = template.rpartition(":")
+        storage = _ACTIVE_TEMPLATE_STORAGE.get()
+        if storage is None or not scope or scope != TemplateRegistry.storage_scope(storage):
+            raise TemplateNotFound(reference)
+        try:
+            item = TemplateRegistry(storage).get(reference)
+        except TemplateRegistryError as exc:
+            raise TemplateNotFound(reference, str(exc)) from exc
+
+        template_id, version = item["template_id"], item["version"]
+        pinned = "@" in reference
+
+        def uptodate() -> bool:
+            active = _ACTIVE_TEMPLATE_STORAGE.get()
+            if active is None:
+                return True
+            registry = TemplateRegistry(active)
+            if pinned:
+                return registry.has_version(template_id, version)
+            return registry.latest_version(template_id) == version
+
+        return item["template"], item["reference"], uptodate
+
+
+REGISTRY_LOADER = RegistryLoader()
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 3)
+
+
+def _field_getter(path: str) -> Callable[[Any], Any]:
+    """Build a getter for ``"key"`` or dotted ``"key.sub"`` paths on dicts/objects."""
+    parts = str(path).split(".")
+
+    def get(item: Any) -> Any:
+        for part in parts:
+            if item is None:
+                return None
+            if isinstance(item, dict):
+                item = item.get(part)
+            else:
+                item = getattr(item, part, None)
+        return item
+
+    return get
+
+
+def _to_decimal(value: Any) -> Optional[Decimal]:
+    if value is None or value == "" or isinstance(value, bool):
+        return None
+    if isinstance(value, Decimal):
+        return value
+    try:
+        return Decimal(value if isinstance(value, str) else str(value))
+    except (InvalidOperation, ValueError):
+        return None
+
 
 def normalize_upsert_mode(mode: Optional[str]) -> str:
     allowed = {"create_or_update", "create_only", "update_only"}
@@ -278,6 +2707,8 @@ class KnowledgeBaseDocumentCore:
     ) -> None:
         self.client = client
         self.default_dataset_id = (default_dataset_id or "").strip() or None
+        # The last operation run by this core; its stats feed the timings output.
+        self.operation: Optional[KnowledgeBaseOperation] = None
 
     def save_text_document(
         self,
@@ -285,6 +2716,21 @@ class KnowledgeBaseDocumentCore:
         rendered_text: Any,
         parameters: Dict[str, Any],
         data_context: Any = None,
+    ) -> Dict[str, Any]:
+        with self.client.operation() as operation:
+            self.operation = operation
+            return self._save_text_document(
+                rendered_text=rendered_text,
+                parameters=parameters,
+                data_context=data_context,
+            )
+
+    def _save_text_document(
+        self,
+        *,
+        rendered_text: Any,
+        parameters: Dict[str, Any],
+        data_context: Any,
     ) -> Dict[str, Any]:
         dataset_id = self._resolve_dataset_id(parameters)
         metadata_input = parse_metadata(parameters.get("metadata_json"))
@@ -427,6 +2873,7 @@ class KnowledgeBaseDocumentCore:
             "POST",
             f"/datasets/{dataset_id}/documents/{document_id}/update_by_text",
             json=payload,
+            idempotent=True,
         )
 
     def _apply_metadata(
@@ -444,28 +2891,12 @@ class KnowledgeBaseDocumentCore:
             f"/datasets/{dataset_id}/metadata",
         )
 
-        def _extract_items(payload: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
-            """Compat helper: usa prima 'doc_metadata', poi 'data' se presente."""
-            if not isinstance(payload, dict):
-                return None
-            if isinstance(payload.get("doc_metadata"), list):
-                return payload["doc_metadata"]
-            if isinstance(payload.get("data"), list):
-                return payload["data"]
-            return None
-
-        items = _extract_items(meta_def_response)
+        items = self._extract_metadata_items(meta_def_response)
         if not isinstance(items, list):
             return metadata
 
         name_to_id: Dict[str, str] = {}
-        for item in items:
-            if not isinstance(item, dict):
-                continue
-            name = str(item.get("name") or "").strip()
-            meta_id = item.get("id")
-            if name and meta_id:
-                name_to_id[name] = str(meta_id)
+        self._merge_metadata_ids(items, name_to_id)
         for key in metadata.keys():
             name = str(key).strip()
             if not name or name in name_to_id:
@@ -493,16 +2924,49 @@ class KnowledgeBaseDocumentCore:
             "GET",
             f"/datasets/{dataset_id}/metadata",
         )
-        items = _extract_items(meta_def_response)
+        items = self._extract_metadata_items(meta_def_response)
         if isinstance(items, list):
-            for item in items:
-                if not isinstance(item, dict):
-                    continue
-                name = str(item.get("name") or "").strip()
-                meta_id = item.get("id")
-                if name and meta_id:
-                    name_to_id[name] = str(meta_id)
+            self._merge_metadata_ids(items, name_to_id)
+
+        payload = self._build_metadata_operation(document_id, metadata, name_to_id)
+        if payload is None:
+            return metadata
+
+        self.client.request(
+            "POST",
+            f"/datasets/{dataset_id}/documents/metadata",
+            json=payload,
+            idempotent=True,
+        )
+        return metadata
 
+    @staticmethod
+    def _extract_metadata_items(payload: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """Compat helper: usa prima 'doc_metadata', poi 'data' se presente."""
+        if not isinstance(payload, dict):
+            return None
+        if isinstance(payload.get("doc_metadata"), list):
+            return payload["doc_metadata"]
+        if isinstance(payload.get("data"), list):
+            return payload["data"]
+        return None
+
+    @staticmethod
+    def _merge_metadata_ids(items: List[Any], name_to_id: Dict[str, str]) -> None:
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            name = str(item.get("name") or "").strip()
+            meta_id = item.get("id")
+            if name and meta_id:
+                name_to_id[name] = str(meta_id)
+
+    @staticmethod
+    def _build_metadata_operation(
+        document_id: str,
+        metadata: Dict[str, Any],
+        name_to_id: Dict[str, str],
+    ) -> Optional[Dict[str, Any]]:
         metadata_list: List[Dict[str, Any]] = []
         for key, value in metadata.items():
             name = str(key).strip()
@@ -520,9 +2984,9 @@ class KnowledgeBaseDocumentCore:
             )
 
         if not metadata_list:
-            return metadata
+            return None
 
-        payload = {
+        return {
             "operation_data": [
                 {
                     "document_id": document_id,
@@ -530,12 +2994,6 @@ class KnowledgeBaseDocumentCore:
                 }
             ]
         }
-        self.client.request(
-            "POST",
-            f"/datasets/{dataset_id}/documents/metadata",
-            json=payload,
-        )
-        return metadata
 
     def _find_document_by_name(
         self,
@@ -547,6 +3005,13 @@ class KnowledgeBaseDocumentCore:
             f"/datasets/{dataset_id}/documents",
             params={"page": 1, "limit": 200, "keyword": document_name},
         )
+        return self._match_document_by_name(response, document_name)
+
+    @staticmethod
+    def _match_document_by_name(
+        response: Dict[str, Any],
+        document_name: str,
+    ) -> Optional[Dict[str, Any]]:
         documents: List[Dict[str, Any]] = []
         data = response.get("data")
         if isinstance(data, dict) and "documents" in data:
@@ -567,6 +3032,12 @@ class KnowledgeBaseDocumentCore:
             "GET",
             f"/datasets/{dataset_id}/documents/{document_id}",
         )
+        return self._check_document_response(response, dataset_id, document_id)
+
+    @staticmethod
+    def _check_document_response(
+        response: Any, dataset_id: str, document_id: str
+    ) -> Dict[str, Any]:
         if not isinstance(response, dict):
             raise KnowledgeBaseError(
                 f"Document {document_id} not found inside dataset {dataset_id}."
@@ -599,6 +3070,10 @@ class KnowledgeBaseChunkCore:
 
     def __init__(self, client: KnowledgeBaseClient) -> None:
         self.client = client
+        # Time spent sleeping between indexing-status polls.
+        self.sleep_seconds = 0.0
+        # The last operation run by this core; its stats feed the timings output.
+        self.operation: Optional[KnowledgeBaseOperation] = None
 
 
     def _wait_for_completed(
@@ -618,29 +3093,49 @@ class KnowledgeBaseChunkCore:
         last_status: str | None = None
         while True:
             document = self._get_document(dataset_id, document_id)
-            status = (
-                document.get("indexing_status")
-                or document.get("data", {}).get("indexing_status")
-                or document.get("document", {}).get("indexing_status")
-            )
-
-            last_status = str(status) if status is not None else None
-
+            last_status = self._check_indexing_status(document, document_id)
             if last_status == "completed":
                 return document
 
-            if last_status in {"error", "failed"}:
-                raise KnowledgeBaseError(
-                    f"Document {document_id} indexing failed with status {last_status!r}."
-                )
-
             if time.time() >= deadline:
                 raise KnowledgeBaseError(
                     f"Timed out waiting for document {document_id} to complete; "
                     f"last indexing_status was {last_status!r}."
                 )
 
-            time.sleep(poll_interval_seconds)
+            slept_from = time.perf_counter()
+            time.sleep(self._poll_sleep(document_id, last_status, poll_interval_seconds))
+            self.sleep_seconds += time.perf_counter() - slept_from
+
+    def _poll_sleep(self, document_id: str, last_status: Optional[str], interval: float) -> float:
+        """Poll interval, shortened so one last poll still fits before the operation deadline."""
+        operation = KnowledgeBaseOperation.current()
+        if operation is None:
+            return interval
+        allowance = self.client.wait_allowance(operation)
+        if allowance <= 0:
+            raise operation.deadline_error(
+                f"waiting for document {document_id} to complete; "
+                f"last indexing_status was {last_status!r}"
+            )
+        return min(interval, allowance)
+
+    @staticmethod
+    def _check_indexing_status(document: Dict[str, Any], document_id: str) -> Optional[str]:
+        """Return the indexing status, raising when indexing ended in error."""
+        status = (
+            document.get("indexing_status")
+            or document.get("data", {}).get("indexing_status")
+            or document.get("document", {}).get("indexing_status")
+        )
+
+        last_status = str(status) if status is not None else None
+
+        if last_status in {"error", "failed"}:
+            raise KnowledgeBaseError(
+                f"Document {document_id} indexing failed with status {last_status!r}."
+            )
+        return last_status
 
     def replace_with_single_segment(
         self,
@@ -651,6 +3146,27 @@ class KnowledgeBaseChunkCore:
         keywords: Optional[List[str]] = None,
         timeout_seconds: int = 60,
         poll_interval_seconds: int = 3,
+    ) -> Dict[str, Any]:
+        with self.client.operation() as operation:
+            self.operation = operation
+            return self._replace_with_single_segment(
+                dataset_id=dataset_id,
+                document_id=document_id,
+                content=content,
+                keywords=keywords,
+                timeout_seconds=timeout_seconds,
+                poll_interval_seconds=poll_interval_seconds,
+            )
+
+    def _replace_with_single_segment(
+        self,
+        *,
+        dataset_id: str,
+        document_id: str,
+        content: Any,
+        keywords: Optional[List[str]],
+        timeout_seconds: int,
+        poll_interval_seconds: int,
     ) -> Dict[str, Any]:
         self._wait_for_completed(
             dataset_id=dataset_id,
@@ -678,18 +3194,10 @@ class KnowledgeBaseChunkCore:
         for segment_id in segment_ids:
             self._delete_segment(dataset_id, document_id, segment_id)
 
-        payload = {
-            "segments": [
-                {
-                    "content": normalized_content,
-                    "keywords": keywords or [],
-                }
-            ]
-        }
         self.client.request(
             "POST",
             f"/datasets/{dataset_id}/documents/{document_id}/segments",
-            json=payload,
+            json=self._build_segment_payload(normalized_content, keywords),
         )
 
         return {
@@ -700,11 +3208,26 @@ class KnowledgeBaseChunkCore:
 
 
 
+    @staticmethod
+    def _build_segment_payload(content: str, keywords: Optional[List[str]]) -> Dict[str, Any]:
+        return {
+            "segments": [
+                {
+                    "content": content,
+                    "keywords": keywords or [],
+                }
+            ]
+        }
+
     def _list_segments(self, dataset_id: str, document_id: str) -> List[str]:
         response = self.client.request(
             "GET",
             f"/datasets/{dataset_id}/documents/{document_id}/segments",
         )
+        return self._extract_segment_ids(response)
+
+    @staticmethod
+    def _extract_segment_ids(response: Dict[str, Any]) -> List[str]:
         segments: List[Dict[str, Any]] = []
         data = response.get("data")
         if isinstance(data, dict) and "segments" in data:
@@ -728,17 +3251,21 @@ class KnowledgeBaseChunkCore:
                 f"/datasets/{dataset_id}/documents/{document_id}/segments/{segment_id}",
             )
         except KnowledgeBaseError as exc:
-            # Se il segmento è già stato eliminato (404 not_found),
-            # non è un errore per noi: lo consideriamo "già cancellato".
-            if exc.status_code == 404:
-                payload = exc.payload or {}
-                error_code = str(payload.get("code") or "").lower()
-                if error_code == "not_found":
-                    return
+            if self._is_segment_already_deleted(exc):
+                return
 
             # Per qualsiasi altro errore, rilanciamo
             raise
 
+    @staticmethod
+    def _is_segment_already_deleted(exc: KnowledgeBaseError) -> bool:
+        # Se il segmento è già stato eliminato (404 not_found),
+        # non è un errore per noi: lo consideriamo "già cancellato".
+        if exc.status_code != 404:
+            return False
+        payload = exc.payload or {}
+        return str(payload.get("code") or "").lower() == "not_found"
+
 
     def _get_document(self, dataset_id: str, document_id: str) -> Dict[str, Any]:
         return self.client.request(
@@ -758,17 +3285,7 @@ class KnowledgeBaseChunkCore:
         name_value: str = document_id  # fallback sicuro
         try:
             doc = self._get_document(dataset_id, document_id)
-            raw = None
-            if isinstance(doc, dict):
-                if isinstance(doc.get("data"), dict):
-                    raw = doc["data"]
-                else:
-                    raw = doc
-
-            if isinstance(raw, dict):
-                candidate = raw.get("name")
-                if isinstance(candidate, str) and candidate.strip():
-                    name_value = candidate
+            name_value = self._extract_document_name(doc, name_value)
         except KnowledgeBaseError:
             pass
 
@@ -781,5 +3298,20 @@ class KnowledgeBaseChunkCore:
             "POST",
             f"/datasets/{dataset_id}/documents/{document_id}/update_by_text",
             json=payload,
+            idempotent=True,
         )
 
+    @staticmethod
+    def _extract_document_name(doc: Any, fallback: str) -> str:
+        raw = None
+        if isinstance(doc, dict):
+            if isinstance(doc.get("data"), dict):
+                raw = doc["data"]
+            else:
+                raw = doc
+
+        if isinstance(raw, dict):
+            candidate = raw.get("name")
+            if isinstance(candidate, str) and candidate.strip():
+                return candidate
+        return fallback
@@ -1,6 +1,7 @@
 from dify_plugin import Plugin, DifyPluginEnv
 
-plugin = Plugin(DifyPluginEnv(MAX_REQUEST_TIMEOUT=120))
-
 if __name__ == '__main__':
+    # Built only when run as the entry point: render pool workers re-import
+    # this module as __mp_main__ and must not start a second plugin.
+    plugin = Plugin(DifyPluginEnv(MAX_REQUEST_TIMEOUT=120))
     plugin.run()
@@ -0,0 +1,72 @@
+"""Circuit breaker behaviour of KnowledgeBaseClient."""
+
+from __future__ import annotations
+
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docfactory_core import (  # noqa: E402
+    CircuitBreaker,
+    CircuitOpenError,
+    KnowledgeBaseClient,
+    RetryPolicy,
+)
+
+# Nothing listens on port 1, so every attempt is a fast connection failure.
+DEAD_BASE_URL = "http://127.0.0.1:1/v1"
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_failures_while_open_keep_the_cooldown(self) -> None:
+        breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=10.0)
+        breaker.record_failure()
+        opened_retry_in = breaker.retry_in()
+        time.sleep(0.05)
+        # A call sent before the circuit opened fails late.
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertLessEqual(breaker.retry_in(), opened_retry_in - 0.05)
+
+    def test_half_open_probe_failure_reopens(self) -> None:
+        breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open())
+
+
+class ClientCircuitTest(unittest.TestCase):
+    def setUp(self) -> None:
+        KnowledgeBaseClient.circuit_breakers.clear()
+
+    def tearDown(self) -> None:
+        KnowledgeBaseClient.circuit_breakers.clear()
+
+    def test_opening_failure_raises_without_backoff(self) -> None:
+        client = KnowledgeBaseClient(
+            DEAD_BASE_URL,
+            "key",
+            retry_policy=RetryPolicy(max_retries=5, base_delay=5.0, max_delay=5.0),
+            breaker_threshold=2,
+            connect_timeout=2.0,
+        )
+        with mock.patch("docfactory_core.time.sleep") as sleep:
+            with self.assertRaises(CircuitOpenError) as caught:
+                client.request("GET", "/datasets/ds/documents")
+        # One backoff after the first failure; the second opens the circuit
+        # and fails at once instead of sleeping another backoff.
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(len(client.calls), 2)
+        self.assertIsNotNone(caught.exception.__cause__)
+        self.assertIn("Last error:", str(caught.exception))
+        self.assertEqual(caught.exception.payload["circuit_breaker"]["state"], CircuitBreaker.OPEN)
+
+
+if __name__ == "__main__":
+    unittest.main()
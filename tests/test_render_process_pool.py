@@ -0,0 +1,71 @@
+"""Pool workers must not construct the Dify plugin defined in main.py.
+
+The plugin runs as ``python -m main``; forkserver/spawn workers re-import that
+module as ``__mp_main__``, so anything main.py does at import time runs again
+in every worker.
+"""
+
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stand-in for the dify_plugin SDK: records the pid of every process that
+# constructs a Plugin, and makes run() start a render pool worker.
+FAKE_DIFY_PLUGIN = textwrap.dedent(
+    """
+    import os
+
+    from docfactory_core import RenderCore
+
+
+    class DifyPluginEnv:
+        def __init__(self, **kwargs):
+            self.kwargs = kwargs
+
+
+    class Plugin:
+        def __init__(self, env):
+            with open(os.environ["DOCFACTORY_PLUGIN_MARKER"], "a") as handle:
+                handle.write(f"{os.getpid()}\\n")
+
+        def run(self):
+            executor = RenderCore.process_pool.get(1)
+            worker_pid = executor.submit(os.getpid).result(timeout=60)
+            assert worker_pid != os.getpid()
+            executor.shutdown()
+    """
+)
+
+
+class RenderProcessPoolEntryPointTest(unittest.TestCase):
+    def test_pool_worker_does_not_construct_plugin(self) -> None:
+        with tempfile.TemporaryDirectory() as stub_dir:
+            with open(os.path.join(stub_dir, "dify_plugin.py"), "w") as handle:
+                handle.write(FAKE_DIFY_PLUGIN)
+            marker = os.path.join(stub_dir, "plugin_pids")
+            env = dict(os.environ)
+            env["PYTHONPATH"] = os.pathsep.join([REPO_ROOT, stub_dir])
+            env["DOCFACTORY_PLUGIN_MARKER"] = marker
+            completed = subprocess.run(
+                [sys.executable, "-m", "main"],
+                cwd=REPO_ROOT,
+                env=env,
+                capture_output=True,
+                text=True,
+                timeout=120,
+            )
+            self.assertEqual(completed.returncode, 0, completed.stderr)
+            with open(marker) as handle:
+                pids = handle.read().split()
+        self.assertEqual(len(pids), 1, f"Plugin constructed in {len(pids)} processes: {pids}")
+
+
+if __name__ == "__main__":
+    unittest.main()
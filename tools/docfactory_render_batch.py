@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+from collections.abc import Generator
+from typing import Any, Dict
+
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+from jinja2 import TemplateSyntaxError
+
+from docfactory_core import RenderBudgetExceeded, RenderCore, TemplateRegistry, plugin_storage
+
+
+class DocfactoryRenderBatchTool(Tool):
+    """Render one Jinja2 template against many JSON records in a single call."""
+
+    def _invoke(
+        self, tool_parameters: dict[str, Any]
+    ) -> Generator[ToolInvokeMessage, None, None]:
+        params: Dict[str, Any] = tool_parameters or {}
+        result: Dict[str, Any] = {
+            "results": [],
+            "record_count": 0,
+            "error_count": 0,
+            "error": None,
+        }
+
+        try:
+            payload = RenderCore.coerce_json(
+                params.get("records"),
+                field_name="records",
+                required=True,
+            )
+            records = RenderCore.extract_records(
+                payload,
+                field_name="records",
+                records_key=self._safe_str(params.get("records_key")),
+            )
+        except ValueError as exc:
+            result["error"] = str(exc)
+            yield from self._yield_messages(result)
+            return
+
+        try:
+            engine_options = RenderCore.coerce_json(
+                params.get("template_engine_options"),
+                field_name="template_engine_options",
+                required=False,
+            )
+        except ValueError as exc:
+            result["error"] = str(exc)
+            yield from self._yield_messages(result)
+            return
+        if engine_options is not None and not isinstance(engine_options, dict):
+            result["error"] = "Template rendering failed: template_engine_options must be a JSON object."
+            yield from self._yield_messages(result)
+            return
+
+        try:
+            template_string, engine_options, reference = TemplateRegistry.resolve(
+                params, plugin_storage(self), engine_options or {}
+            )
+        except Exception as exc:
+            result["error"] = str(exc)
+            yield from self._yield_messages(result)
+            return
+        if reference:
+            result["template_reference"] = reference
+
+        try:
+            renderer = RenderCore(storage=plugin_storage(self))
+            results = renderer.render_batch(
+                template_string,
+                records,
+                engine_options or {},
+            )
+        except TemplateSyntaxError as exc:
+            result["error"] = f"Template compilation failed: {exc}"
+            yield from self._yield_messages(result)
+            return
+        except RenderBudgetExceeded as exc:
+            result["error"] = f"Template sandbox limit exceeded: {exc}"
+            yield from self._yield_messages(result)
+            return
+        except Exception as exc:
+            result["error"] = f"Template rendering failed: {exc}"
+            yield from self._yield_messages(result)
+            return
+
+        result["results"] = results
+        result["record_count"] = len(results)
+        result["error_count"] = sum(1 for item in results if item.get("error"))
+        result["context_stats"] = renderer.stats.get("context")
+        yield from self._yield_messages(result)
+
+    @staticmethod
+    def _safe_str(value: Any) -> str | None:
+        if value is None:
+            return None
+        text = str(value).strip()
+        return text or None
+
+    def _yield_messages(
+        self, result: Dict[str, Any]
+    ) -> Generator[ToolInvokeMessage, None, None]:
+        yield self.create_json_message(result)
+
+        error = result.get("error")
+        if error:
+            yield self.create_text_message(f"DocFactory batch render error: {error}")
+        else:
+            yield self.create_text_message(
+                f"Rendered {result['record_count']} records "
+                f"({result['error_count']} with errors)."
+            )
+        yield self.create_variable_message("error", error or "")
@@ -1,12 +1,13 @@
 from __future__ import annotations
 
+import time
 from collections.abc import Generator
 from typing import Any, Dict
 
 from dify_plugin import Tool
 from dify_plugin.entities.tool import ToolInvokeMessage
 
-from docfactory_core import RenderCore
+from docfactory_core import RenderBudgetExceeded, RenderCore, TemplateRegistry, plugin_storage
 
 
 class DocfactoryRenderTool(Tool):
@@ -18,6 +19,7 @@ class DocfactoryRenderTool(Tool):
     def _invoke(
         self, tool_parameters: dict[str, Any]
     ) -> Generator[ToolInvokeMessage, None, None]:
+        started = time.perf_counter()
         params: Dict[str, Any] = tool_parameters or {}
         result: Dict[str, Any] = {"rendered_text": "", "error": None}
 
@@ -31,12 +33,8 @@ class DocfactoryRenderTool(Tool):
             result["error"] = str(exc)
             yield from self._yield_error_messages(result)
             return
-
-        template_string = params.get("template")
-        if not isinstance(template_string, str) or not template_string.strip():
-            result["error"] = "template is required and must be a non-empty string."
-            yield from self._yield_error_messages(result)
-            return
+        # Decoding a large data payload can cost more than the render itself.
+        data_parse_ms = round((time.perf_counter() - started) * 1000, 3)
 
         try:
             engine_options = RenderCore.coerce_json(
@@ -48,20 +46,50 @@ class DocfactoryRenderTool(Tool):
             result["error"] = str(exc)
             yield from self._yield_error_messages(result)
             return
+        if engine_options is not None and not isinstance(engine_options, dict):
+            result["error"] = "Template rendering failed: template_engine_options must be a JSON object."
+            yield from self._yield_error_messages(result)
+            return
 
         try:
-            renderer = RenderCore()
+            template_string, engine_options, reference = TemplateRegistry.resolve(
+                params, plugin_storage(self), engine_options or {}
+            )
+        except Exception as exc:
+            result["error"] = str(exc)
+            yield from self._yield_error_messages(result)
+            return
+        if reference:
+            result["template_reference"] = reference
+
+        engine_options = engine_options or {}
+        if engine_options.get("stream"):
+            yield from self._stream_render(
+                template_string, data_context, engine_options, started, data_parse_ms
+            )
+            return
+
+        try:
+            renderer = RenderCore(storage=plugin_storage(self))
             rendered_text = renderer.render(
                 template_string,
                 data_context,
-                engine_options or {},
+                engine_options,
             )
+        except RenderBudgetExceeded as exc:
+            result["error"] = f"Template sandbox limit exceeded: {exc}"
+            yield from self._yield_error_messages(result)
+            return
         except Exception as exc:  
             result["error"] = f"Template rendering failed: {exc}"
             yield from self._yield_error_messages(result)
             return
 
         result["rendered_text"] = rendered_text
+        result["context_stats"] = renderer.stats.get("context")
+        self._apply_output_stats(result, renderer.stats.get("output"))
+        if engine_options.get("timings"):
+            result["timings"] = self._build_timings(renderer, rendered_text, started, data_parse_ms)
 
         yield self.create_json_message(result)
 
@@ -70,11 +98,87 @@ class DocfactoryRenderTool(Tool):
             yield self.create_text_message(snippet)
         else:
             yield self.create_text_message("Template rendered successfully but produced empty text.")
+        if result.get("truncated"):
+            yield self.create_text_message(
+                f"DocFactory render truncated: output exceeded max_output_chars "
+                f"({result['output_chars']} characters kept)."
+            )
 
         if len(rendered_text) <= self.MAX_VARIABLE_LENGTH:
             yield self.create_variable_message("rendered_text", rendered_text)
         yield self.create_variable_message("error", "")
 
+    def _stream_render(
+        self,
+        template_string: str,
+        data_context: Any,
+        engine_options: Dict[str, Any],
+        started: float,
+        data_parse_ms: float,
+    ) -> Generator[ToolInvokeMessage, None, None]:
+        result: Dict[str, Any] = {
+            "rendered_text": "",
+            "streamed": True,
+            "chunk_count": 0,
+            "output_chars": 0,
+            "error": None,
+        }
+        chunk_size = engine_options.get("stream_chunk_size") or self.MAX_TEXT_MESSAGE_LENGTH
+        output_bytes = 0
+        measure = bool(engine_options.get("timings"))
+        try:
+            renderer = RenderCore(storage=plugin_storage(self))
+            chunks = renderer.render_stream(
+                template_string,
+                data_context,
+                engine_options,
+                chunk_size=int(chunk_size),
+            )
+            for chunk in chunks:
+                result["chunk_count"] += 1
+                result["output_chars"] += len(chunk)
+                if measure:
+                    output_bytes += len(chunk.encode("utf-8"))
+                yield self.create_text_message(chunk)
+        except RenderBudgetExceeded as exc:
+            result["error"] = f"Template sandbox limit exceeded: {exc}"
+            yield from self._yield_error_messages(result)
+            return
+        except Exception as exc:
+            result["error"] = f"Template rendering failed: {exc}"
+            yield from self._yield_error_messages(result)
+            return
+
+        result["context_stats"] = renderer.stats.get("context")
+        self._apply_output_stats(result, renderer.stats.get("output"))
+        if measure:
+            result["timings"] = self._build_timings(renderer, None, started, data_parse_ms)
+            result["timings"]["output_chars"] = result["output_chars"]
+            result["timings"]["output_bytes"] = output_bytes
+        yield self.create_json_message(result)
+        yield self.create_variable_message("error", "")
+
+    @staticmethod
+    def _build_timings(
+        renderer: RenderCore, rendered_text: str | None, started: float, data_parse_ms: float
+    ) -> Dict[str, Any]:
+        """Where the invocation spent its time: data decode, parse, compile (cache hit/miss), render."""
+        timings: Dict[str, Any] = {"data_parse_ms": data_parse_ms}
+        timings.update(renderer.stats.get("timings") or {})
+        if rendered_text is not None:
+            timings["output_chars"] = len(rendered_text)
+            timings["output_bytes"] = len(rendered_text.encode("utf-8"))
+        timings["total_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return timings
+
+    @staticmethod
+    def _apply_output_stats(result: Dict[str, Any], output_stats: Any) -> None:
+        if not output_stats:
+            return
+        result["truncated"] = bool(output_stats.get("truncated"))
+        result["output_chars"] = output_stats.get("output_chars", 0)
+        result["output_bytes"] = output_stats.get("output_bytes", 0)
+
     def _yield_error_messages(
         self, result: Dict[str, Any]
     ) -> Generator[ToolInvokeMessage, None, None]:
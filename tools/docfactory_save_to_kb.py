@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import time
 from collections.abc import Generator
 from typing import Any, Dict
 
@@ -11,6 +12,8 @@ from docfactory_core import (
     KnowledgeBaseDocumentCore,
     KnowledgeBaseError,
     RenderCore,
+    build_kb_timings,
+    kb_timings_enabled,
 )
 
 
@@ -20,6 +23,7 @@ class DocfactorySaveToKBTool(Tool):
     def _invoke(
         self, tool_parameters: dict[str, Any]
     ) -> Generator[ToolInvokeMessage, None, None]:
+        started = time.perf_counter()
         params: Dict[str, Any] = tool_parameters or {}
 
         result: Dict[str, Any] = {
@@ -73,6 +77,11 @@ class DocfactorySaveToKBTool(Tool):
         else:
             result.update(summary)
 
+        result["circuit_breaker"] = core.client.circuit_state()
+
+        if kb_timings_enabled(params):
+            result["timings"] = build_kb_timings(core, started)
+
         yield from self._yield_messages(result)
 
     def _build_document_core(self) -> KnowledgeBaseDocumentCore:
@@ -83,7 +92,7 @@ class DocfactorySaveToKBTool(Tool):
             raise KnowledgeBaseError(
                 "dify_api_base_url and dify_api_key must be configured for SaveToKB tool."
             )
-        client = KnowledgeBaseClient(base_url, api_key)
+        client = KnowledgeBaseClient.from_credentials(credentials)
         return KnowledgeBaseDocumentCore(
             client,
             default_dataset_id=credentials.get("default_dataset_id"),
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import time
 from collections.abc import Generator
 from typing import Any, Dict, Optional
 
@@ -11,7 +12,9 @@ from docfactory_core import (
     KnowledgeBaseClient,
     KnowledgeBaseError,
     RenderCore,
+    build_kb_timings,
     extract_keywords,
+    kb_timings_enabled,
 )
 
 
@@ -21,6 +24,7 @@ class DocfactorySingleChunkTool(Tool):
     def _invoke(
         self, tool_parameters: dict[str, Any]
     ) -> Generator[ToolInvokeMessage, None, None]:
+        started = time.perf_counter()
         params: Dict[str, Any] = tool_parameters or {}
 
         dataset_id = self._resolve_dataset_id(params)
@@ -86,6 +90,11 @@ class DocfactorySingleChunkTool(Tool):
         else:
             result.update(summary)
 
+        result["circuit_breaker"] = core.client.circuit_state()
+
+        if kb_timings_enabled(params):
+            result["timings"] = build_kb_timings(core, started)
+
         yield from self._yield_messages(result)
 
     def _build_chunk_core(self) -> KnowledgeBaseChunkCore:
@@ -96,7 +105,7 @@ class DocfactorySingleChunkTool(Tool):
             raise KnowledgeBaseError(
                 "dify_api_base_url and dify_api_key must be configured for the SingleChunk tool."
             )
-        client = KnowledgeBaseClient(base_url, api_key)
+        client = KnowledgeBaseClient.from_credentials(credentials)
         return KnowledgeBaseChunkCore(client)
 
     def _resolve_dataset_id(self, params: Dict[str, Any]) -> Optional[str]:
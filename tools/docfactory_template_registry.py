@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+from collections.abc import Generator
+from typing import Any, Dict
+
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+from docfactory_core import RenderCore, TemplateRegistry, plugin_storage
+
+
+class DocfactoryTemplateRegistryTool(Tool):
+    """Register, version and list named templates kept in plugin storage."""
+
+    OPERATIONS = ("register", "list", "versions", "get", "delete", "prune")
+
+    def _invoke(
+        self, tool_parameters: dict[str, Any]
+    ) -> Generator[ToolInvokeMessage, None, None]:
+        params: Dict[str, Any] = tool_parameters or {}
+        operation = (self._safe_str(params.get("operation")) or "list").lower()
+        result: Dict[str, Any] = {"operation": operation, "error": None}
+
+        if operation not in self.OPERATIONS:
+            result["error"] = f"operation must be one of: {', '.join(self.OPERATIONS)}."
+            yield from self._yield_messages(result)
+            return
+
+        template_id = self._safe_str(params.get("template_id"))
+        if operation != "list" and not template_id:
+            result["error"] = f"template_id is required for operation '{operation}'."
+            yield from self._yield_messages(result)
+            return
+
+        try:
+            registry = TemplateRegistry(plugin_storage(self))
+            if operation == "register":
+                engine_options = RenderCore.coerce_json(
+                    params.get("template_engine_options"),
+                    field_name="template_engine_options",
+                    required=False,
+                )
+                result["template"] = registry.register(
+                    template_id,
+                    params.get("template"),
+                    engine_options=engine_options or {},
+                    description=self._safe_str(params.get("description")),
+                )
+            elif operation == "get":
+                result["template"] = registry.get(template_id)
+            elif operation == "versions":
+                result["versions"] = registry.list_versions(template_id)
+            elif operation == "delete":
+                result["removed"] = registry.delete(template_id)
+            elif operation == "prune":
+                result["removed"] = registry.prune(
+                    template_id, self._keep_versions(params.get("keep_versions"))
+                )
+            else:
+                result["templates"] = registry.list_templates()
+        except Exception as exc:
+            result["error"] = f"Template registry {operation} failed: {exc}"
+
+        yield from self._yield_messages(result)
+
+    @staticmethod
+    def _keep_versions(value: Any) -> int:
+        try:
+            return max(1, int(value)) if value not in (None, "") else 1
+        except (TypeError, ValueError):
+            raise ValueError("keep_versions must be a positive integer.")
+
+    @staticmethod
+    def _safe_str(value: Any) -> str | None:
+        if value is None:
+            return None
+        text = str(value).strip()
+        return text or None
+
+    def _yield_messages(
+        self, result: Dict[str, Any]
+    ) -> Generator[ToolInvokeMessage, None, None]:
+        yield self.create_json_message(result)
+
+        error = result.get("error")
+        if error:
+            yield self.create_text_message(f"DocFactory template registry error: {error}")
+        elif result.get("template"):
+            yield self.create_text_message(
+                f"Template {result['template']['reference']} ({result['operation']})."
+            )
+            yield self.create_variable_message("template_reference", result["template"]["reference"])
+        elif "removed" in result:
+            yield self.create_text_message(f"{len(result['removed'])} versions removed.")
+        elif "versions" in result:
+            yield self.create_text_message(f"{len(result['versions'])} versions found.")
+        else:
+            yield self.create_text_message(f"{len(result.get('templates') or [])} templates registered.")
+        yield self.create_variable_message("error", error or "")